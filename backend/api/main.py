@@ -4,6 +4,7 @@ from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 import os
 import sys
+import threading
 import uuid
 import shutil
 from pathlib import Path
@@ -29,6 +30,17 @@ app.add_middleware(
 
 app.include_router(router, prefix="/api")
 
+@app.on_event("startup")
+def warm_ocr_reader():
+    # With a cloud key, extraction never touches local OCR: don't load (and hold) the models.
+    # Otherwise load them in the background for the in-process paths (short clips, re-run
+    # chunks); parallel workers start clean and load their own in the pool initializer
+    from cv.video_processor_unified import get_processing_mode
+    if get_processing_mode() != "local":
+        return
+    from cv.ocr import init_reader
+    threading.Thread(target=init_reader, daemon=True).start()
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
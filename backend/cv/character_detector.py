@@ -80,7 +80,7 @@ def identify_character(portrait) -> str:
     
     # filter out very dark pixels (background)
     bright_mask = val > 50
-    if np.sum(bright_mask) < 100:
+    if np.count_nonzero(bright_mask) < 100:
         return None
     
     median_hue = np.median(hue[bright_mask])
@@ -8,12 +8,34 @@ rather than a single snapshot.
 Follows the same cv2 extraction pattern as offstage_classifier.py.
 """
 
-import base64
+import os
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import MappingProxyType
 from typing import List, Optional, Tuple
 
+# Optional SIMD base64 (same API as the stdlib module)
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Optional PyAV for reading container metadata without scanning the stream
+try:
+    import av
+    PYAV_AVAILABLE = True
+except ImportError:
+    PYAV_AVAILABLE = False
+
+# Optional on-disk cache for encoded frames
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
 
 # Frame offsets per event type (seconds relative to event timestamp)
 EVENT_FRAME_OFFSETS = {
@@ -37,6 +59,91 @@ MAX_FRAME_WIDTH = 1280
 # JPEG quality for encoding
 JPEG_QUALITY = 85
 
+# Max threads for parallel JPEG encoding
+MAX_ENCODE_WORKERS = 8
+
+# Disk cache of encoded frames, so re-analyzing a video skips decode + encode
+FRAME_CACHE_DIR = Path(__file__).parent.parent.parent / "data" / "event_frames"
+FRAME_CACHE_SIZE_LIMIT = 2 ** 30  # ~1GB, least-recently-used entries evicted first
+_frame_cache = None
+
+# Capture backends already warned about ignoring CAP_PROP_BUFFERSIZE
+_buffer_hint_warned = set()
+
+# Tip selection priority (lower = extracted first) and severity adjustments
+_PRIORITY_ORDER = MappingProxyType({
+    "stock_lost": 0,
+    "got_edgeguarded": 1,
+    "damage_taken": 2,
+    "edgeguard": 3,
+    "combo": 4,
+    "stock_taken": 5,
+})
+_SEVERITY_BOOST = MappingProxyType({"high": -0.5, "medium": 0, "positive": 0.5, "low": 1, "info": 2})
+
+# Prompt guidance per skill tier
+_TIER_GUIDANCE = MappingProxyType({
+    "low": "The player is a beginner. Focus on fundamental concepts: basic spacing, shield usage, and simple punishes.",
+    "mid": "The player has intermediate skills. Discuss specific defensive options, DI mixups, and recognizable setups.",
+    "high": "The player is advanced. Analyze option coverage, frame advantage situations, and optimal punish routes.",
+    "top": "The player is competitive-level. Discuss conditioning reads, DI mixup percentages, and frame-specific interactions.",
+})
+
+# Coaching-focused prompts — moves are already identified in WHAT HAPPENED
+_TYPE_PROMPTS = MappingProxyType({
+    "stock_lost": (
+        "The player lost a stock. The moves used are identified in WHAT HAPPENED below. "
+        "FIRST: Identify the opponent's ACTUAL FINISHING MOVE (the move that sent the player flying to their death) by looking at the frames carefully. "
+        "A spike/meteor (downward hit while offstage) looks different from a grounded kill move. "
+        "If the player died offstage at low percent, it was very likely a spike (dair) or meteor smash — NOT a grounded kill move. "
+        "State it at the start in format: KILL MOVE: [move name]\n"
+        "Then focus your analysis on:\n"
+        "1. What positioning or spacing mistake led to getting hit?\n"
+        "2. What could they have done differently — better DI, different recovery path, avoid the situation entirely?\n"
+        "3. Give one specific, actionable tip to avoid this death next time."
+    ),
+    "damage_taken": (
+        "The player took significant damage. The moves are identified below. "
+        "Focus your analysis on:\n"
+        "1. What was the player doing before getting hit — approaching unsafely, landing predictably, whiffing a move?\n"
+        "2. What defensive option would have avoided this — shield, spot dodge, spacing differently?\n"
+        "3. Give one specific, actionable tip."
+    ),
+    "combo": (
+        "The player executed a combo. The moves are identified below. "
+        "Focus your analysis on:\n"
+        "1. Look at the positioning across frames — was the spacing and timing clean?\n"
+        "2. Did they drop the combo early or extend it well? What follow-ups were available?\n"
+        "3. Give one specific tip for optimizing this combo at this percent range."
+    ),
+    "edgeguard": (
+        "The player went offstage for an edgeguard. The moves are identified below. "
+        "Focus your analysis on:\n"
+        "1. Was this a safe edgeguard choice given the opponent's recovery options?\n"
+        "2. Look at positioning — could they have covered more options or been safer?\n"
+        "3. Give one specific tip for edgeguarding this opponent."
+    ),
+    "got_edgeguarded": (
+        "The player got edgeguarded. The moves are identified below. "
+        "Focus your analysis on:\n"
+        "1. Was the player's recovery path predictable from the frames?\n"
+        "2. What alternative recovery route would have been safer?\n"
+        "3. Give one specific tip for recovering in this situation."
+    ),
+    "stock_taken": (
+        "The player took the opponent's stock. The moves are identified below. "
+        "Focus your analysis on:\n"
+        "1. Look at the setup — how did they create the kill opportunity?\n"
+        "2. Was the opponent's DI readable from their position in the frames?\n"
+        "3. Is this a repeatable setup? Give one specific tip for securing kills earlier."
+    ),
+})
+
+_DEFAULT_TYPE_PROMPT = (
+    "Analyze the positioning and player decisions in this sequence. "
+    "The moves are already identified below — focus on spacing, stage control, and actionable advice."
+)
+
 
 def extract_event_frame_sequences(
     video_path: str,
@@ -74,21 +181,11 @@ def extract_event_frame_sequences(
         return []
 
     # Prioritize tips: stock_lost > got_edgeguarded > damage_taken(high) > edgeguard > combo > others
-    priority_order = {
-        "stock_lost": 0,
-        "got_edgeguarded": 1,
-        "damage_taken": 2,
-        "edgeguard": 3,
-        "combo": 4,
-        "stock_taken": 5,
-    }
-    severity_boost = {"high": -0.5, "medium": 0, "positive": 0.5, "low": 1, "info": 2}
-
     scored_tips = []
     for idx, tip in enumerate(tips):
         tip_type = tip.get("type", "")
-        base_priority = priority_order.get(tip_type, 6)
-        sev = severity_boost.get(tip.get("severity", ""), 1)
+        base_priority = _PRIORITY_ORDER.get(tip_type, 6)
+        sev = _SEVERITY_BOOST.get(tip.get("severity", ""), 1)
         scored_tips.append((base_priority + sev, idx, tip))
 
     scored_tips.sort(key=lambda x: x[0])
@@ -101,22 +198,32 @@ def extract_event_frame_sequences(
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         return []
-
-    video_fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    _limit_decode_buffer(cap)
+
+    # CAP_PROP_FRAME_COUNT can scan the whole stream on some containers;
+    # prefer the container header when PyAV can read it
+    probed = _probe_video(video_path)
+    if probed:
+        video_fps, total_frames = probed
+    else:
+        video_fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     if video_fps <= 0 or total_frames <= 0:
         cap.release()
         return []
 
     video_duration = total_frames / video_fps
 
-    results = []
+    # Plan pass: work out which frames each event needs. Clustered events
+    # often share frames, so each frame number is only decoded once.
+    plans = []  # (tip_idx, timestamp, type, [(offset, abs_time, frame_num), ...])
+    wanted_frames = set()
     for _, tip_idx, tip in selected:
         ts = tip.get("timestamp", 0)
         tip_type = tip.get("type", "")
         offsets = EVENT_FRAME_OFFSETS.get(tip_type, DEFAULT_OFFSETS)
 
-        frames = []
+        slots = []
         for offset in offsets:
             abs_time = ts + offset
             if abs_time < 0 or abs_time > video_duration:
@@ -124,24 +231,41 @@ def extract_event_frame_sequences(
 
             frame_num = int(abs_time * video_fps)
             frame_num = max(0, min(frame_num, total_frames - 1))
+            slots.append((offset, abs_time, frame_num))
+            wanted_frames.add(frame_num)
+
+        plans.append((tip_idx, ts, tip_type, slots))
+
+    # Reuse frames encoded by earlier runs on the same, unchanged video
+    frame_cache = _get_frame_cache()
+    frame_b64 = {}
+    if frame_cache is not None:
+        video_key = (str(Path(video_path).resolve()), int(os.path.getmtime(video_path)))
+        for frame_num in wanted_frames:
+            b64 = frame_cache.get(video_key + (frame_num, MAX_FRAME_WIDTH, JPEG_QUALITY))
+            if b64 is not None:
+                frame_b64[frame_num] = b64
+
+    missing = sorted(wanted_frames - frame_b64.keys())
+    if missing:
+        encoded = _decode_and_encode(cap, missing)
+        frame_b64.update(encoded)
+        if frame_cache is not None:
+            for frame_num, b64 in encoded.items():
+                frame_cache.set(video_key + (frame_num, MAX_FRAME_WIDTH, JPEG_QUALITY), b64)
 
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-            ret, frame = cap.read()
-            if not ret:
-                continue
-
-            # Resize if too large
-            if frame.shape[1] > MAX_FRAME_WIDTH:
-                scale = MAX_FRAME_WIDTH / frame.shape[1]
-                frame = cv2.resize(
-                    frame, (MAX_FRAME_WIDTH, int(frame.shape[0] * scale))
-                )
+    cap.release()
 
-            _, buf = cv2.imencode(
-                ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
-            )
-            b64 = base64.b64encode(buf.tobytes()).decode("utf-8")
+    if not frame_b64:
+        return []
 
+    results = []
+    for tip_idx, ts, tip_type, slots in plans:
+        frames = []
+        for offset, abs_time, frame_num in slots:
+            b64 = frame_b64.get(frame_num)
+            if b64 is None:
+                continue
             frames.append({
                 "offset": offset,
                 "abs_time": round(abs_time, 2),
@@ -156,10 +280,108 @@ def extract_event_frame_sequences(
                 "frames": frames,
             })
 
-    cap.release()
     return results
 
 
+def _limit_decode_buffer(cap) -> None:
+    """
+    Ask the capture backend to keep a single decoded frame buffered.
+    We only do sparse seeks, so anything decoded ahead is thrown away.
+    Some backends (e.g. most FFmpeg builds) ignore the hint; warn once per backend.
+    """
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    if cap.get(cv2.CAP_PROP_BUFFERSIZE) != 1:
+        backend = cap.getBackendName()
+        if backend not in _buffer_hint_warned:
+            _buffer_hint_warned.add(backend)
+            print(f"[EventContext] {backend} backend ignored CAP_PROP_BUFFERSIZE=1")
+
+
+def _probe_video(video_path: str) -> Optional[Tuple[float, int]]:
+    """Read (fps, total_frames) from container metadata via PyAV. None if unavailable."""
+    if not PYAV_AVAILABLE:
+        return None
+    try:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            if not stream.average_rate:
+                return None
+            fps = float(stream.average_rate)
+            total_frames = stream.frames
+            if not total_frames and stream.duration and stream.time_base:
+                total_frames = int(stream.duration * stream.time_base * fps)
+            if not total_frames and container.duration:
+                total_frames = int(container.duration / av.time_base * fps)
+    except Exception:
+        return None
+    if fps <= 0 or not total_frames:
+        return None
+    return fps, total_frames
+
+
+def _decode_and_encode(cap, frame_nums: List[int]) -> dict:
+    """Decode, resize and JPEG-encode the given sorted frame numbers. Returns {frame_num: base64}."""
+    # All frames share the video's native resolution, so decide the output
+    # size and interpolation once rather than per frame. INTER_AREA is the
+    # better filter for downscaling; same-size resizes are plain copies.
+    src_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    src_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if src_w <= 0 or src_h <= 0:
+        return {}
+    if src_w > MAX_FRAME_WIDTH:
+        out_size = (MAX_FRAME_WIDTH, int(src_h * (MAX_FRAME_WIDTH / src_w)))
+        interpolation = cv2.INTER_AREA
+    else:
+        out_size = (src_w, src_h)
+        interpolation = cv2.INTER_LINEAR
+
+    def resize_into(frame, dst):
+        cv2.resize(frame, out_size, dst=dst, interpolation=interpolation)
+
+    # Seek pass: decode each frame in file order, resizing straight into
+    # one pre-allocated batch instead of a fresh array per frame
+    batch = np.empty((len(frame_nums), out_size[1], out_size[0], 3), dtype=np.uint8)
+    decoded_nums = []
+    for frame_num in frame_nums:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        ret, frame = cap.read()
+        if not ret:
+            continue
+        resize_into(frame, batch[len(decoded_nums)])
+        decoded_nums.append(frame_num)
+
+    if not decoded_nums:
+        return {}
+
+    # Encode pass: cv2.imencode releases the GIL, so the independent
+    # frames encode in parallel on a thread pool
+    workers = min(MAX_ENCODE_WORKERS, os.cpu_count() or 1, len(decoded_nums))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        encoded = list(executor.map(_encode_jpeg, batch[:len(decoded_nums)]))
+    return {
+        frame_num: base64.b64encode(buf).decode("ascii")
+        for frame_num, buf in zip(decoded_nums, encoded)
+    }
+
+
+def _get_frame_cache():
+    """Lazily open the encoded-frame disk cache (None if diskcache isn't installed)."""
+    global _frame_cache
+    if _frame_cache is None and DISKCACHE_AVAILABLE:
+        _frame_cache = diskcache.Cache(
+            str(FRAME_CACHE_DIR),
+            size_limit=FRAME_CACHE_SIZE_LIMIT,
+            eviction_policy="least-recently-used",
+        )
+    return _frame_cache
+
+
+def _encode_jpeg(frame: np.ndarray) -> bytes:
+    """Encode a BGR frame as JPEG bytes."""
+    _, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return buf.tobytes()
+
+
 def build_sequence_vision_prompt(
     event_seq: dict,
     tip: dict,
@@ -196,68 +418,9 @@ def build_sequence_vision_prompt(
 
     tier_ctx = ""
     if skill_tier:
-        tier_guidance = {
-            "low": "The player is a beginner. Focus on fundamental concepts: basic spacing, shield usage, and simple punishes.",
-            "mid": "The player has intermediate skills. Discuss specific defensive options, DI mixups, and recognizable setups.",
-            "high": "The player is advanced. Analyze option coverage, frame advantage situations, and optimal punish routes.",
-            "top": "The player is competitive-level. Discuss conditioning reads, DI mixup percentages, and frame-specific interactions.",
-        }
-        tier_ctx = tier_guidance.get(skill_tier, "")
-
-    # Coaching-focused prompts — moves are already identified in WHAT HAPPENED
-    type_prompts = {
-        "stock_lost": (
-            "The player lost a stock. The moves used are identified in WHAT HAPPENED below. "
-            "FIRST: Identify the opponent's ACTUAL FINISHING MOVE (the move that sent the player flying to their death) by looking at the frames carefully. "
-            "A spike/meteor (downward hit while offstage) looks different from a grounded kill move. "
-            "If the player died offstage at low percent, it was very likely a spike (dair) or meteor smash — NOT a grounded kill move. "
-            "State it at the start in format: KILL MOVE: [move name]\n"
-            "Then focus your analysis on:\n"
-            "1. What positioning or spacing mistake led to getting hit?\n"
-            "2. What could they have done differently — better DI, different recovery path, avoid the situation entirely?\n"
-            "3. Give one specific, actionable tip to avoid this death next time."
-        ),
-        "damage_taken": (
-            "The player took significant damage. The moves are identified below. "
-            "Focus your analysis on:\n"
-            "1. What was the player doing before getting hit — approaching unsafely, landing predictably, whiffing a move?\n"
-            "2. What defensive option would have avoided this — shield, spot dodge, spacing differently?\n"
-            "3. Give one specific, actionable tip."
-        ),
-        "combo": (
-            "The player executed a combo. The moves are identified below. "
-            "Focus your analysis on:\n"
-            "1. Look at the positioning across frames — was the spacing and timing clean?\n"
-            "2. Did they drop the combo early or extend it well? What follow-ups were available?\n"
-            "3. Give one specific tip for optimizing this combo at this percent range."
-        ),
-        "edgeguard": (
-            "The player went offstage for an edgeguard. The moves are identified below. "
-            "Focus your analysis on:\n"
-            "1. Was this a safe edgeguard choice given the opponent's recovery options?\n"
-            "2. Look at positioning — could they have covered more options or been safer?\n"
-            "3. Give one specific tip for edgeguarding this opponent."
-        ),
-        "got_edgeguarded": (
-            "The player got edgeguarded. The moves are identified below. "
-            "Focus your analysis on:\n"
-            "1. Was the player's recovery path predictable from the frames?\n"
-            "2. What alternative recovery route would have been safer?\n"
-            "3. Give one specific tip for recovering in this situation."
-        ),
-        "stock_taken": (
-            "The player took the opponent's stock. The moves are identified below. "
-            "Focus your analysis on:\n"
-            "1. Look at the setup — how did they create the kill opportunity?\n"
-            "2. Was the opponent's DI readable from their position in the frames?\n"
-            "3. Is this a repeatable setup? Give one specific tip for securing kills earlier."
-        ),
-    }
+        tier_ctx = _TIER_GUIDANCE.get(skill_tier, "")
 
-    analysis_prompt = type_prompts.get(tip_type, (
-        "Analyze the positioning and player decisions in this sequence. "
-        "The moves are already identified below — focus on spacing, stage control, and actionable advice."
-    ))
+    analysis_prompt = _TYPE_PROMPTS.get(tip_type, _DEFAULT_TYPE_PROMPT)
 
     # Compute damage deltas from game states — moves are identified algorithmically
     damage_section = ""
@@ -8,21 +8,46 @@ GPT-4o vision to compare against gameplay footage.
 
 import re
 import os
+import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from io import BytesIO
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 import numpy as np
 
+# Optional Numba for the GIF frame scoring kernel
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
 _UFD_BASE = "https://ultimateframedata.com"
 _CACHE_DIR = Path(__file__).parent.parent.parent / "data" / "hitbox_cache"
 _CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Shared session so the page scrape and GIF downloads reuse pooled keep-alive
+# connections instead of a fresh TCP+TLS handshake per request
+_SESSION = requests.Session()
+_SESSION.headers["User-Agent"] = "ssbu-coach/1.0 (hitbox reference fetcher)"
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.3),
+))
+
+# Also keep downloaded GIFs on disk (normally only the extracted PNG is cached)
+_KEEP_GIFS = os.getenv("HITBOX_KEEP_GIFS") == "1"
+
 # Map our internal move names to UFD GIF suffixes
 _MOVE_TO_SUFFIX = {
     "jab": "Jab1",
@@ -45,6 +70,12 @@ _MOVE_TO_SUFFIX = {
     "dthrow": "DThrow",
 }
 
+# Lowercased suffix -> original suffix, built once for GIF filename matching
+_SUFFIX_LOWER = {s.lower(): s for s in _MOVE_TO_SUFFIX.values()}
+_SUFFIX_SET = frozenset(_SUFFIX_LOWER)
+_SUFFIX_MIN_LEN = min(len(s) for s in _SUFFIX_SET)
+_SUFFIX_MAX_LEN = max(len(s) for s in _SUFFIX_SET)
+
 # Map our character keys to UFD URL slugs
 # Characters whose key matches the slug directly don't need an entry
 _CHAR_TO_SLUG = {
@@ -87,8 +118,48 @@ _CHAR_TO_SLUG = {
     "zero suit samus": "zero_suit_samus",
 }
 
+# Resolved reference images: (slug, suffix) -> PNG path, or None when the
+# character's UFD page has no GIF for that move
+_IMG_PATH_CACHE: dict[tuple[str, str], Optional[Path]] = {}
+
+# On-disk copy of the scraped URL maps so warm starts skip the UFD page fetch.
+# Bump the version whenever _MOVE_TO_SUFFIX changes to invalidate old entries.
+_URL_CACHE_PATH = _CACHE_DIR / "_url_cache.json"
+_URL_CACHE_VERSION = 1
+
+
+def _load_url_cache() -> dict[str, dict[str, str]]:
+    """Load persisted slug -> {move_suffix -> gif_url} maps, if still valid."""
+    try:
+        data = json.loads(_URL_CACHE_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != _URL_CACHE_VERSION:
+        return {}
+    return data.get("slugs", {})
+
+
+def _save_url_cache() -> None:
+    """Atomically write the successfully scraped URL maps to disk."""
+    slugs = {slug: url_map for slug, url_map in _gif_url_cache.items() if url_map}
+    tmp_path = _URL_CACHE_PATH.with_suffix(".json.tmp")
+    try:
+        tmp_path.write_text(json.dumps({"version": _URL_CACHE_VERSION, "slugs": slugs}))
+        os.replace(tmp_path, _URL_CACHE_PATH)
+    except OSError as e:
+        logger.warning(f"Failed to persist hitbox URL cache: {e}")
+
+
 # Cache: slug -> {move_suffix -> gif_url}
-_gif_url_cache: dict[str, dict[str, str]] = {}
+_gif_url_cache: dict[str, dict[str, str]] = _load_url_cache()
+# Guards _gif_url_cache and _gif_slug_locks; never held across a network call
+_gif_url_lock = threading.Lock()
+# Per-slug locks held while scraping, so concurrent fetches for one character share a
+# single page load without blocking other characters
+_gif_slug_locks: dict[str, threading.Lock] = {}
+
+# Max concurrent UFD downloads in get_candidate_hitbox_images
+_FETCH_WORKERS = 8
 
 
 def _get_slug(character: str) -> str:
@@ -100,91 +171,168 @@ def _get_slug(character: str) -> str:
     return re.sub(r'[.\s]+', '_', char_key).strip('_')
 
 
-def _scrape_gif_urls(slug: str) -> dict[str, str]:
-    """Scrape all hitbox GIF URLs from a character's UFD page."""
-    if slug in _gif_url_cache:
-        return _gif_url_cache[slug]
+def _match_move_suffix(base: str) -> Optional[str]:
+    """Return the move suffix a lowercased GIF basename ends with, if any."""
+    # Find where the move suffix starts (after character prefix) by
+    # checking each tail length against the suffix set
+    for n in range(min(len(base), _SUFFIX_MAX_LEN), _SUFFIX_MIN_LEN - 1, -1):
+        tail = base[-n:]
+        if tail in _SUFFIX_SET:
+            return _SUFFIX_LOWER[tail]
+    return None
 
-    url = f"{_UFD_BASE}/{slug}"
-    try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-    except Exception as e:
-        logger.warning(f"Failed to fetch UFD page for {slug}: {e}")
-        _gif_url_cache[slug] = {}
-        return {}
 
-    # Extract all GIF paths
-    pattern = rf'hitboxes/{re.escape(slug)}/([^"]+\.gif)'
-    matches = re.findall(pattern, resp.text, re.IGNORECASE)
-
-    # Build mapping: GIF filename (without prefix) -> full URL
-    url_map = {}
-    for filename in set(matches):
-        full_url = f"{_UFD_BASE}/hitboxes/{slug}/{filename}"
-        # Strip the character prefix to get the move suffix
-        # e.g., "CloudBAir.gif" -> "BAir"
-        base = filename.rsplit('.', 1)[0]  # Remove .gif
-        # Find where the move suffix starts (after character prefix)
-        for suffix in _MOVE_TO_SUFFIX.values():
-            if base.endswith(suffix) or base.lower().endswith(suffix.lower()):
+def _scrape_gif_urls(slug: str) -> dict[str, str]:
+    """Scrape all hitbox GIF URLs from a character's UFD page."""
+    with _gif_url_lock:
+        if slug in _gif_url_cache:
+            return _gif_url_cache[slug]
+        slug_lock = _gif_slug_locks.setdefault(slug, threading.Lock())
+
+    with slug_lock:
+        # Another thread may have scraped this slug while we waited
+        with _gif_url_lock:
+            if slug in _gif_url_cache:
+                return _gif_url_cache[slug]
+
+        url = f"{_UFD_BASE}/{slug}"
+        try:
+            resp = _SESSION.get(url, timeout=10)
+            resp.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Failed to fetch UFD page for {slug}: {e}")
+            with _gif_url_lock:
+                _gif_url_cache[slug] = {}
+            return {}
+
+        # Extract all GIF paths, deduplicating as we go
+        pattern = re.compile(rf'hitboxes/{re.escape(slug)}/([^"]+\.gif)', re.IGNORECASE)
+        filenames = {m.group(1) for m in pattern.finditer(resp.text)}
+
+        # Build mapping: GIF filename (without prefix) -> full URL
+        url_map = {}
+        for filename in filenames:
+            full_url = f"{_UFD_BASE}/hitboxes/{slug}/{filename}"
+            # Strip the character prefix to get the move suffix
+            # e.g., "CloudBAir.gif" -> "BAir"
+            base = filename.rsplit('.', 1)[0].lower()  # Remove .gif
+            suffix = _match_move_suffix(base)
+            if suffix:
                 url_map[suffix] = full_url
-                break
 
-    _gif_url_cache[slug] = url_map
-    logger.info(f"Scraped {len(url_map)} hitbox GIF URLs for {slug}")
-    return url_map
+        with _gif_url_lock:
+            _gif_url_cache[slug] = url_map
+            if url_map:
+                _save_url_cache()
+        logger.info(f"Scraped {len(url_map)} hitbox GIF URLs for {slug}")
+        return url_map
 
 
-def _download_gif(url: str, cache_path: Path) -> Optional[Path]:
-    """Download a GIF and save to cache."""
+def _download_gif(url: str, cache_path: Optional[Path] = None) -> Optional[BytesIO]:
+    """
+    Download a GIF into memory.
+    Only the extracted PNG is needed afterwards, so the GIF itself is written
+    to cache_path only when _KEEP_GIFS is set (for debugging). This skips the
+    disk round-trip, not the buffering: the whole GIF is held in memory, since
+    PIL seeks back and forth in it to find the frame.
+    """
     try:
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-        cache_path.parent.mkdir(parents=True, exist_ok=True)
-        cache_path.write_bytes(resp.content)
-        return cache_path
+        # the context manager returns the connection to the shared pool even on errors
+        with _SESSION.get(url, timeout=15) as resp:
+            resp.raise_for_status()
+            buf = BytesIO(resp.content)
+        if _KEEP_GIFS and cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_bytes(buf.getvalue())
+        return buf
     except Exception as e:
         logger.warning(f"Failed to download GIF {url}: {e}")
         return None
 
 
-def _extract_hitbox_frame(gif_path: Path) -> Optional[Path]:
+def _hitbox_score_numpy(arr: np.ndarray) -> int:
+    """Count visible pixels in an RGBA frame that match a hitbox color."""
+    r, g, b, a = arr[:, :, 0], arr[:, :, 1], arr[:, :, 2], arr[:, :, 3]
+    # One fused predicate so NumPy only keeps a single mask alive:
+    # red (high R, low G/B), purple/magenta (high R/B, low G),
+    # yellow (high R/G, low B), blue (low R/G, high B)
+    return int(np.count_nonzero(
+        (a > 100) & (
+            ((r > 170) & (g < 100) & (b < 100))
+            | ((r > 140) & (g < 80) & (b > 140))
+            | ((r > 180) & (g > 150) & (b < 80))
+            | ((r < 80) & (g < 80) & (b > 170))
+        )
+    ))
+
+
+# GIF frames are scored at 1/N resolution per side
+_SCORE_DOWNSAMPLE = 4
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _score_row(arr, y):
+        count = 0
+        for x in range(arr.shape[1]):
+            r = arr[y, x, 0]
+            g = arr[y, x, 1]
+            b = arr[y, x, 2]
+            if arr[y, x, 3] > 100 and (
+                (r > 170 and g < 100 and b < 100)
+                or (r > 140 and g < 80 and b > 140)
+                or (r > 180 and g > 150 and b < 80)
+                or (r < 80 and g < 80 and b > 170)
+            ):
+                count += 1
+        return count
+
+    @njit(cache=True)
+    def _score_frame(arr):
+        count = 0
+        for y in range(arr.shape[0]):
+            count += _score_row(arr, y)
+        return count
+
+
+def _hitbox_score(arr: np.ndarray) -> int:
+    """Count hitbox-colored pixels, using the Numba kernel when available."""
+    if not NUMBA_AVAILABLE:
+        return _hitbox_score_numpy(arr)
+    return int(_score_frame(arr))
+
+
+def _extract_hitbox_frame(gif_source, png_path: Path) -> Optional[Path]:
     """
     Extract the frame showing the active hitbox from a GIF.
     Looks for the frame with the most red/colored (hitbox indicator) pixels.
+    gif_source is a path or an in-memory file object.
     Saves as PNG and returns the path.
     """
-    png_path = gif_path.with_suffix('.png')
     if png_path.exists():
         return png_path
 
     try:
-        img = Image.open(gif_path)
+        img = Image.open(gif_source)
     except Exception as e:
-        logger.warning(f"Failed to open GIF {gif_path}: {e}")
+        logger.warning(f"Failed to open GIF for {png_path.stem}: {e}")
         return None
 
     best_frame = 0
     best_score = 0
 
+    # Score on a downsampled copy: we only need the frame with the most
+    # hitbox pixels, and hitbox blobs are far wider than the sample step.
+    # NEAREST keeps the flat palette colors instead of blending them.
+    score_size = (
+        max(1, img.width // _SCORE_DOWNSAMPLE),
+        max(1, img.height // _SCORE_DOWNSAMPLE),
+    )
+
     for i in range(img.n_frames):
         img.seek(i)
-        frame = img.convert('RGBA')
+        frame = img.resize(score_size, Image.NEAREST).convert('RGBA')
         arr = np.array(frame)
-        # Detect hitbox colors: red, purple/magenta, yellow, blue circles
-        r, g, b, a = arr[:, :, 0], arr[:, :, 1], arr[:, :, 2], arr[:, :, 3]
-        visible = a > 100
-        # Red hitboxes (high R, low G, low B)
-        red = visible & (r > 170) & (g < 100) & (b < 100)
-        # Purple/magenta hitboxes (high R, low G, high B)
-        purple = visible & (r > 140) & (g < 80) & (b > 140)
-        # Yellow hitboxes (high R, high G, low B)
-        yellow = visible & (r > 180) & (g > 150) & (b < 80)
-        # Blue hitboxes
-        blue = visible & (r < 80) & (g < 80) & (b > 170)
-
-        score = int(red.sum() + purple.sum() + yellow.sum() + blue.sum())
+        score = _hitbox_score(arr)
         if score > best_score:
             best_score = score
             best_frame = i
@@ -207,6 +355,7 @@ def _extract_hitbox_frame(gif_path: Path) -> Optional[Path]:
         scale = max_dim / max(w, h)
         composite = composite.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
 
+    png_path.parent.mkdir(parents=True, exist_ok=True)
     composite.save(png_path, 'PNG', optimize=True)
     return png_path
 
@@ -229,23 +378,36 @@ def get_hitbox_image(character: str, move_name: str) -> Optional[Path]:
         return None
 
     slug = _get_slug(character)
+    key = (slug, suffix)
+
+    # Check in-process cache first, then disk
+    if key in _IMG_PATH_CACHE:
+        return _IMG_PATH_CACHE[key]
 
-    # Check cache first
     png_path = _CACHE_DIR / slug / f"{suffix}.png"
     if png_path.exists():
+        _IMG_PATH_CACHE[key] = png_path
         return png_path
 
-    gif_path = _CACHE_DIR / slug / f"{suffix}.gif"
-    if not gif_path.exists():
+    # A GIF may already be on disk from older runs or _KEEP_GIFS
+    gif_source = _CACHE_DIR / slug / f"{suffix}.gif"
+    if not gif_source.exists():
         # Scrape URL and download
         url_map = _scrape_gif_urls(slug)
         gif_url = url_map.get(suffix)
         if not gif_url:
+            if url_map:
+                # Page scraped fine but has no GIF for this move: won't change
+                _IMG_PATH_CACHE[key] = None
             return None
-        if not _download_gif(gif_url, gif_path):
+        gif_source = _download_gif(gif_url, gif_source)
+        if gif_source is None:
             return None
 
-    return _extract_hitbox_frame(gif_path)
+    result = _extract_hitbox_frame(gif_source, png_path)
+    if result:
+        _IMG_PATH_CACHE[key] = result
+    return result
 
 
 def get_candidate_hitbox_images(
@@ -262,8 +424,35 @@ def get_candidate_hitbox_images(
     Returns:
         List of (move_name, damage, image_path_or_None)
     """
+    slug = _get_slug(character)
+    suffixes = {name: _MOVE_TO_SUFFIX.get(name.strip().lower()) for name, _ in move_candidates}
+
+    # Only cache misses block on the network; skip the pool when everything is warm
+    cold = {
+        suffix for suffix in suffixes.values()
+        if suffix
+        and (slug, suffix) not in _IMG_PATH_CACHE
+        and not (_CACHE_DIR / slug / f"{suffix}.png").exists()
+    }
+
+    fetched: dict[str, Optional[Path]] = {}
+    if len(cold) > 1:
+        # One download per suffix ("jab" and "jab combo" share a GIF)
+        with ThreadPoolExecutor(max_workers=min(_FETCH_WORKERS, len(cold))) as executor:
+            futures = {}
+            for name, _ in move_candidates:
+                suffix = suffixes[name]
+                if suffix in cold and suffix not in futures:
+                    futures[suffix] = executor.submit(get_hitbox_image, character, name)
+            for suffix, future in futures.items():
+                fetched[suffix] = future.result()
+
     results = []
     for name, dmg in move_candidates:
-        img_path = get_hitbox_image(character, name)
+        suffix = suffixes[name]
+        if suffix in fetched:
+            img_path = fetched[suffix]
+        else:
+            img_path = get_hitbox_image(character, name)
         results.append((name, dmg, img_path))
     return results
@@ -1,15 +1,19 @@
 """
 Lightweight offstage/onstage classifier for death context.
 Runs ONLY on short windows around candidate death events to gate edgeguard detection.
-Uses Gemini Vision on gameplay-area crops; batches frames to limit API calls.
+Uses Gemini Vision on gameplay-area crops; packs several candidates per call to limit API calls.
 """
 import os
+import atexit
 import json
-import base64
+import math
+import threading
 import cv2
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 # Optional Gemini
 try:
@@ -27,6 +31,18 @@ WINDOW_LOOKBACK_SEC = 1.5
 WINDOW_LOOKAHEAD_SEC = 0.2
 WINDOW_FPS = 10
 MAX_FRAMES_PER_CALL = 8
+# Candidates are packed together into requests of up to this many frames
+MAX_FRAMES_PER_PACK = MAX_FRAMES_PER_CALL * 8
+MAX_CONCURRENT_CALLS = 4
+# Open captures kept per process, so repeated passes over a video skip codec setup and probing
+MAX_POOLED_CAPS = 4
+# Gemini reads positions fine at this quality and the upload is ~30% smaller than at 85
+JPEG_QUALITY = 75
+# Frames are only used for the gameplay crops; Gemini reads on/offstage fine at this width
+CROP_WIDTH = 640
+
+_cap_cache: "OrderedDict[Tuple[str, float], cv2.VideoCapture]" = OrderedDict()
+_cap_lock = threading.Lock()
 
 
 def classify_death_context(
@@ -67,21 +83,17 @@ def classify_death_context(
     api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
     genai.configure(api_key=api_key)
 
-    results = []
-    for cand in candidate_deaths:
-        ts = cand.get("timestamp", 0)
-        victim = cand.get("victim", "p2")
-        cand_type = cand.get("type", "got_edgeguarded")
+    # Decode the union of all windows once and encode each frame once (cv2.imencode
+    # releases the GIL, so the pool runs in parallel); windows are sliced from the result
+    timeline = _decode_timeline(video_path, [c.get("timestamp", 0) for c in candidate_deaths])
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+        encoded = dict(zip(timeline, executor.map(_encode_crop, timeline.values())))
+    windows = [_slice_window(encoded, c.get("timestamp", 0)) for c in candidate_deaths]
 
-        # Extract frames in [ts - 1.5, ts + 0.2] at WINDOW_FPS
-        frames_with_t = _extract_window_frames(
-            video_path,
-            death_time=ts,
-            lookback=WINDOW_LOOKBACK_SEC,
-            lookahead=WINDOW_LOOKAHEAD_SEC,
-            fps=WINDOW_FPS,
-        )
-        if not frames_with_t:
+    results = []
+    groups = []  # (index into results, [(t, jpeg bytes)])
+    for cand, cropped in zip(candidate_deaths, windows):
+        if not cropped:
             results.append({
                 **cand,
                 "victim_offstage_ratio": 0.0,
@@ -89,24 +101,28 @@ def classify_death_context(
                 "is_edgeguard": False,
                 "debug": "no_frames",
             })
-            print(f"[OffstageClassifier] {cand_type} @ {ts:.1f}s: no frames extracted")
+            print(f"[OffstageClassifier] {cand.get('type', 'got_edgeguarded')} @ {cand.get('timestamp', 0):.1f}s: no frames extracted")
             continue
-
-        # Crop to gameplay area (remove HUD): center ~70% of height, full width
-        cropped = []
-        for t, frame_bgr in frames_with_t:
-            crop = _crop_gameplay_region(frame_bgr)
-            _, buf = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            cropped.append((t, buf.tobytes()))
-
-        # Batch into chunks of MAX_FRAMES_PER_CALL
-        all_p1 = []
-        all_p2 = []
-        for i in range(0, len(cropped), MAX_FRAMES_PER_CALL):
-            chunk = cropped[i : i + MAX_FRAMES_PER_CALL]
-            p1_states, p2_states = _run_vision_classifier(chunk)
-            all_p1.extend(p1_states)
-            all_p2.extend(p2_states)
+        results.append(None)
+        groups.append((len(results) - 1, cropped))
+
+    # Several candidates share one request; packs run concurrently to overlap round trips
+    states = {idx: ([], []) for idx, _ in groups}
+    packs = _pack_groups(groups, MAX_FRAMES_PER_PACK)
+    if packs:
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_CALLS, len(packs))) as executor:
+            for pack, pack_states in zip(packs, executor.map(_run_vision_classifier, packs)):
+                for (idx, _), (p1_states, p2_states) in zip(pack, pack_states):
+                    states[idx][0].extend(p1_states)
+                    states[idx][1].extend(p2_states)
+
+    for idx, cand in enumerate(candidate_deaths):
+        if results[idx] is not None:
+            continue
+        ts = cand.get("timestamp", 0)
+        victim = cand.get("victim", "p2")
+        cand_type = cand.get("type", "got_edgeguarded")
+        all_p1, all_p2 = states[idx]
 
         # Victim is in analysis space (p1=you, p2=opponent). In frame, P1=left, P2=right.
         # Convert to video space: you_are_p1 -> you=P1 left, opp=P2 right; else you=P2 right, opp=P1 left
@@ -129,114 +145,228 @@ def classify_death_context(
         )
         print(f"[OffstageClassifier] {cand_type} @ {ts:.1f}s: {debug}")
 
-        results.append({
+        results[idx] = {
             **cand,
             "victim_offstage_ratio": round(victim_offstage_ratio, 3),
             "victim_ledge_ratio": round(victim_ledge_ratio, 3),
             "is_edgeguard": is_edgeguard,
             "debug": debug,
-        })
+        }
     return results
 
 
+def _encode_crop(frame_bgr: np.ndarray) -> bytes:
+    """JPEG-encode the gameplay crop of one frame."""
+    # Crop to gameplay area (remove HUD): center ~70% of height, full width
+    crop = _crop_gameplay_region(frame_bgr)
+    _, buf = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return buf.tobytes()
+
+
+def _pack_groups(
+    groups: List[Tuple[int, List[Tuple[float, bytes]]]],
+    max_frames: int,
+) -> List[List[Tuple[int, List[Tuple[float, bytes]]]]]:
+    """
+    Greedily pack frame groups into requests of at most max_frames distinct frames; oversized
+    groups are split. Frames shared by overlapping windows only count once per pack.
+    """
+    pieces = []
+    for idx, frames in groups:
+        for i in range(0, len(frames), max_frames):
+            pieces.append((idx, frames[i : i + max_frames]))
+
+    packs = []
+    current = []
+    current_times = set()
+    for piece in pieces:
+        new_times = {t for t, _ in piece[1]} - current_times
+        if current and len(current_times) + len(new_times) > max_frames:
+            packs.append(current)
+            current = []
+            current_times = set()
+            new_times = {t for t, _ in piece[1]}
+        current.append(piece)
+        current_times |= new_times
+    if current:
+        packs.append(current)
+    return packs
+
+
 def _crop_gameplay_region(frame: np.ndarray) -> np.ndarray:
     """Crop to gameplay area: drop top 10% and bottom 25% (HUD). Keep center 65% height."""
     h, w = frame.shape[:2]
     y0 = int(h * 0.10)
     y1 = int(h * 0.75)
-    return frame[y0:y1, :].copy()
+    # A view is enough: callers only read it (imencode copies into the JPEG stream)
+    return frame[y0:y1, :]
 
 
-def _extract_window_frames(
+def _decode_timeline(
     video_path: str,
-    death_time: float,
-    lookback: float,
-    lookahead: float,
-    fps: float,
-) -> List[Tuple[float, np.ndarray]]:
-    """Extract frames in [death_time - lookback, death_time + lookahead] at given fps."""
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return []
+    timestamps: List[float],
+    fps: float = WINDOW_FPS,
+) -> Dict[float, np.ndarray]:
+    """
+    Decode the sampled frames inside the death windows around timestamps.
+    Frames are sampled on one grid shared by all windows, so overlapping windows reuse
+    the same decoded frames; samples in the gaps between windows are skipped. Returns {time_sec: frame} in ascending time order.
+    """
+    if not timestamps:
+        return {}
+    # the pooled capture is shared, so only one decode uses it at a time
+    with _cap_lock:
+        cap = _get_cap(video_path)
+        if cap is None:
+            return {}
+        return _decode_spans(cap, timestamps, fps)
+
+
+def _decode_spans(cap: cv2.VideoCapture, timestamps: List[float], fps: float) -> Dict[float, np.ndarray]:
     video_fps = cap.get(cv2.CAP_PROP_FPS)
     if video_fps <= 0:
-        cap.release()
-        return []
-
-    start_t = max(0.0, death_time - lookback)
-    end_t = death_time + lookahead
-    out = []
-    t = start_t
-    while t <= end_t:
-        frame_num = int(t * video_fps)
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-        ret, frame = cap.read()
-        if ret:
-            if frame.shape[1] > 1280:
-                scale = 1280 / frame.shape[1]
-                frame = cv2.resize(frame, (1280, int(frame.shape[0] * scale)))
-            out.append((t, frame))
-        t += 1.0 / fps
-    cap.release()
+        return {}
+    stride = max(1, round(video_fps / fps))
+
+    # Window bounds as grid frame numbers; merge windows that overlap or sit within a
+    # second of each other (walking forward is cheaper than another keyframe seek)
+    spans = []
+    wanted = set()
+    for ts in sorted(timestamps):
+        lo = math.ceil(max(0.0, ts - WINDOW_LOOKBACK_SEC) * video_fps / stride - 1e-9) * stride
+        hi = int((ts + WINDOW_LOOKAHEAD_SEC) * video_fps / stride + 1e-9) * stride
+        if hi < lo:
+            continue
+        wanted.update(range(lo, hi + 1, stride))
+        if spans and lo - spans[-1][1] <= video_fps:
+            spans[-1][1] = max(spans[-1][1], hi)
+        else:
+            spans.append([lo, hi])
+
+    # Seek once per span, then grab() past everything that isn't a sample inside one of
+    # the windows; gaps between merged windows are walked but never decoded or kept
+    out = {}
+    for lo, hi in spans:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, lo)
+        for frame_num in range(lo, hi + 1):
+            if frame_num not in wanted:
+                if not cap.grab():
+                    break
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame.shape[1] > CROP_WIDTH:
+                scale = CROP_WIDTH / frame.shape[1]
+                frame = cv2.resize(frame, (CROP_WIDTH, int(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+            out[frame_num / video_fps] = frame
     return out
 
 
-def _run_vision_classifier(frames_with_bytes: List[Tuple[float, bytes]]) -> Tuple[List[str], List[str]]:
-    """Call Gemini with gameplay crops; return (p1_states, p2_states) per frame. Each state: onstage | offstage | on_ledge | unknown."""
-    if not frames_with_bytes or not GEMINI_AVAILABLE:
-        return ([], [])
+def _get_cap(video_path: str) -> Optional[cv2.VideoCapture]:
+    """Return a pooled VideoCapture for video_path, opening it (and probing the container) only once."""
+    try:
+        # mtime in the key so a file replaced at the same path gets a fresh capture
+        key = (video_path, os.path.getmtime(video_path))
+    except OSError:
+        return None
+    cap = _cap_cache.pop(key, None)
+    if cap is None:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+    _cap_cache[key] = cap  # most recently used last
+    while len(_cap_cache) > MAX_POOLED_CAPS:
+        _, oldest = _cap_cache.popitem(last=False)
+        oldest.release()
+    return cap
+
+
+@atexit.register
+def _release_caps() -> None:
+    with _cap_lock:
+        for cap in _cap_cache.values():
+            cap.release()
+        _cap_cache.clear()
+
+
+def _slice_window(timeline: Dict[float, Any], death_time: float) -> List[Tuple[float, Any]]:
+    """Frames of the decoded timeline in [death_time - lookback, death_time + lookahead]."""
+    start_t = max(0.0, death_time - WINDOW_LOOKBACK_SEC) - 1e-6
+    end_t = death_time + WINDOW_LOOKAHEAD_SEC + 1e-6
+    return [(t, frame) for t, frame in timeline.items() if start_t <= t <= end_t]
+
+
+def _run_vision_classifier(
+    groups: List[Tuple[int, List[Tuple[float, bytes]]]],
+) -> List[Tuple[List[str], List[str]]]:
+    """
+    Call Gemini with several groups of gameplay crops; return (p1_states, p2_states) per group.
+    Each state: onstage | offstage | on_ledge | unknown. A frame shared by overlapping groups
+    is uploaded and classified once, then mapped back to every group that contains it.
+    """
+    if not groups or not GEMINI_AVAILABLE:
+        return [([], []) for _ in groups]
+
+    # One image per distinct timestamp, in time order
+    images = {}
+    for _, frames in groups:
+        for t, b in frames:
+            images.setdefault(t, b)
+    image_ids = {t: i for i, t in enumerate(sorted(images), 1)}
 
     model = genai.GenerativeModel("gemini-2.0-flash")
     prompt_parts = [
-        """You are analyzing Super Smash Bros Ultimate gameplay. For each image, classify each player's position:
+        """You are analyzing Super Smash Bros Ultimate gameplay. The images below are numbered frames
+from a few short clips of one match. For each image, classify each player's position:
 - "onstage": character is clearly on the main stage platform (not in the air off the edge)
 - "offstage": character is off the stage (in the air or below stage, recovering or being hit)
 - "on_ledge": character is hanging on the ledge (grabbing ledge)
 - "unknown": cannot tell (obscured, UI, or ambiguous)
 
 Player 1 (P1) is typically on the LEFT side of the stage, Player 2 (P2) on the RIGHT.
-Return ONLY a JSON array with one object per image, each with keys: "p1_state", "p2_state".
+Return ONLY a JSON object with one entry per image, each with keys: "id", "p1_state", "p2_state".
 Use only those exact strings: "onstage", "offstage", "on_ledge", "unknown".
 
-Example: [{"p1_state": "onstage", "p2_state": "offstage"}, {"p1_state": "onstage", "p2_state": "on_ledge"}]
+Example: {"frames": [{"id": 1, "p1_state": "onstage", "p2_state": "offstage"}, {"id": 2, "p1_state": "onstage", "p2_state": "on_ledge"}]}
 
-Images (one per frame in order):
+Images:
 """
     ]
-    for i, (t, b) in enumerate(frames_with_bytes):
-        prompt_parts.append(f"\n--- Frame {i+1} (t={t:.1f}s) ---")
-        prompt_parts.append({
-            "mime_type": "image/jpeg",
-            "data": base64.b64encode(b).decode("utf-8"),
-        })
-    prompt_parts.append("\n\nReturn ONLY the JSON array:")
+    for t, image_id in image_ids.items():
+        prompt_parts.append(f"\n--- Frame {image_id} (t={t:.1f}s) ---")
+        # Raw bytes go out as a binary blob; base64 would add a pass and 33% size
+        prompt_parts.append({"mime_type": "image/jpeg", "data": images[t]})
+    prompt_parts.append("\n\nReturn ONLY the JSON object:")
 
     try:
         response = model.generate_content(
             prompt_parts,
-            generation_config=genai.types.GenerationConfig(temperature=0.0, max_output_tokens=1024),
+            generation_config=genai.types.GenerationConfig(temperature=0.0, max_output_tokens=4096),
         )
         text = response.text.strip()
         if "```json" in text:
             text = text.split("```json")[1].split("```")[0].strip()
         elif "```" in text:
             text = text.split("```")[1].split("```")[0].strip()
-        arr = json.loads(text)
-        p1_states = []
-        p2_states = []
-        for obj in arr:
+        data = json.loads(text)
+        states_by_id = {}
+        for obj in data.get("frames", []):
             p1 = (obj.get("p1_state") or "unknown").strip().lower()
             p2 = (obj.get("p2_state") or "unknown").strip().lower()
             if p1 not in ("onstage", "offstage", "on_ledge", "unknown"):
                 p1 = "unknown"
             if p2 not in ("onstage", "offstage", "on_ledge", "unknown"):
                 p2 = "unknown"
-            p1_states.append(p1)
-            p2_states.append(p2)
-        return (p1_states, p2_states)
+            states_by_id[str(obj.get("id"))] = (p1, p2)
+        out = []
+        for _, frames in groups:
+            pairs = [states_by_id.get(str(image_ids[t]), ("unknown", "unknown")) for t, _ in frames]
+            out.append(([p1 for p1, _ in pairs], [p2 for _, p2 in pairs]))
+        return out
     except Exception as e:
         print(f"[OffstageClassifier] Vision error: {e}")
-        return (["unknown"] * len(frames_with_bytes), ["unknown"] * len(frames_with_bytes))
+        return [(["unknown"] * len(frames), ["unknown"] * len(frames)) for _, frames in groups]
 
 
 def refine_edgeguards_with_vision(
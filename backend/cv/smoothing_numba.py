@@ -0,0 +1,55 @@
+"""
+Numba kernel for the sequential half of state smoothing.
+
+smooth_states_vec in cv.video_processor handles the parts that only depend on
+the raw readings (percent cap, running max) as array ops; what's left compares
+each reading with the last accepted one, which this compiles to a plain loop.
+Numba is optional: NUMBA_AVAILABLE is False without it and video_processor
+keeps its Python loop.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def smooth_all(readings, running_max):
+        """
+        Jump/drop/stock rules of smooth_state, in place on an (N, 4) float64
+        array of p1/p2 percent and p1/p2 stocks (NaN = missing). Percents must
+        already be capped; running_max is the (N, 2) running_max_percents.
+        """
+        max_jump = 70.0
+        last = np.array([0.0, 0.0, 3.0, 3.0])
+        for r in range(readings.shape[0]):
+            for i in range(2):
+                p = readings[r, i]
+                if np.isnan(p):
+                    continue
+                if last[i] == 0 and p > 100:
+                    # first read: allow up to 100% (could have missed earlier readings)
+                    readings[r, i] = np.nan
+                elif last[i] > 0 and not p > running_max[r, i]:
+                    if p > last[i] + max_jump:
+                        readings[r, i] = np.nan
+                    elif p < last[i] - 15 and p > 10:
+                        # percent dropped but not to near-zero: OCR error
+                        readings[r, i] = np.nan
+                if not np.isnan(readings[r, i]):
+                    last[i] = readings[r, i]
+            for i in range(2, 4):
+                s = readings[r, i]
+                if np.isnan(s):
+                    continue
+                # stocks can only decrease by 1 at a time and never increase
+                if s < last[i] - 1 or s > last[i]:
+                    readings[r, i] = last[i]
+                last[i] = readings[r, i]
+        return readings
+else:
+    smooth_all = None
@@ -1,30 +1,46 @@
 import cv2
 import numpy as np
 import sys
+from functools import lru_cache
 from pathlib import Path
 
+# Optional Numba for the stock-profile peak scan
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from cv.ocr import read_percent
+from cv.ocr import read_percent, read_percent_batch
 from cv.character_detector import detect_characters
 
+# thumbnail size for the gameplay gate
+GATE_THUMB_SIZE = (64, 36)
+
 def is_gameplay_frame(frame) -> bool:
     """
     Quick check if this frame looks like actual gameplay vs menu/loading/transition.
     Uses simple heuristics to skip non-game frames.
     """
-    h, w = frame.shape[:2]
+    # both gates are frame-wide means, so a point-sampled thumbnail gives the same
+    # answer. nearest (not area) sampling: averaging blocks of different colors
+    # would pull the saturation mean down
+    small = cv2.resize(frame, GATE_THUMB_SIZE, interpolation=cv2.INTER_NEAREST)
+    return is_gameplay_thumbnail(small)
+
+def is_gameplay_thumbnail(small) -> bool:
+    """is_gameplay_frame on an already downsampled BGR thumbnail (e.g. resized on the GPU)."""
+    # one HSV conversion covers both checks: V stands in for brightness
+    hsv_means = cv2.mean(cv2.cvtColor(small, cv2.COLOR_BGR2HSV))
     
     # check if frame is mostly black (loading/transition)
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    mean_brightness = np.mean(gray)
-    if mean_brightness < 20:
+    if hsv_means[2] < 20:
         return False
     
     # check for color variance (gameplay has more color diversity than menus)
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    saturation = hsv[:, :, 1]
-    if np.mean(saturation) < 30:
+    if hsv_means[1] < 30:
         return False
     
     return True
@@ -105,16 +121,34 @@ UI_REGIONS_VGC_720P = {
     "stock_spacing": 3,
 }
 
-def detect_game_state(frame, timestamp: float) -> dict:
+# once the same layout reads percents this many sampled frames in a row it is
+# recorded as layout_cache["locked"] (the HUD rarely changes within a video)
+LAYOUT_LOCK_STREAK = 5
+# the lock is dropped again after this many locked frames in a row read no
+# percent (camera/overlay change, or a wrong lock during an intro)
+LAYOUT_UNLOCK_MISSES = 10
+
+# pre-scaled regions per (layout, frame size); a video never changes size
+_SCALED_CACHE: dict = {}
+
+
+def detect_game_state(frame, timestamp: float, locked_layout: tuple = None, layout_cache: dict = None) -> dict:
     """
     Extract game state from a single frame.
     Returns dict with percents, stocks, positions, etc.
     Tries multiple layout types if the first one fails.
+    
+    locked_layout: (regions, base_w, base_h) to use without trying the others.
+    layout_cache: optional dict kept by the caller for one video; records which
+    layout wins and sets "locked" once one wins LAYOUT_LOCK_STREAK frames in a row,
+    and drops it after LAYOUT_UNLOCK_MISSES locked frames in a row read no percent.
     """
     h, w = frame.shape[:2]
     
     # Try different layouts in order of likelihood
-    if h <= 800:
+    if locked_layout is not None:
+        layouts_to_try = [locked_layout]
+    elif h <= 800:
         layouts_to_try = [
             (UI_REGIONS_TOURNAMENT_720P, 1280, 720),
             (UI_REGIONS_VGC_720P, 1280, 720),
@@ -127,65 +161,138 @@ def detect_game_state(frame, timestamp: float) -> dict:
             (UI_REGIONS_1080P, 1920, 1080),
         ]
     
-    best_state = None
-    best_score = 0
-    
+    state = {
+        "timestamp": round(timestamp, 2),
+        "p1_percent": None,
+        "p2_percent": None,
+        "p1_stocks": None,
+        "p2_stocks": None,
+        "p1_character": None,
+        "p2_character": None,
+    }
+    
+    # OCR dominates the cost of a frame, so stop at the first layout that reads
+    # either percent. if none does, the most likely layout is used for stocks
+    layout = layouts_to_try[0]
+    found = False
     for regions, base_w, base_h in layouts_to_try:
-        scale_x, scale_y = w / base_w, h / base_h
-        
-        state = {
-            "timestamp": round(timestamp, 2),
-            "p1_percent": None,
-            "p2_percent": None,
-            "p1_stocks": None,
-            "p2_stocks": None,
-            "p1_character": None,
-            "p2_character": None,
-        }
+        scaled = _get_scaled_layout(regions, base_w, base_h, w, h)
         
         # read percent values using OCR
-        p1_region = get_scaled_region(regions["p1_percent"], scale_x, scale_y)
-        p2_region = get_scaled_region(regions["p2_percent"], scale_x, scale_y)
-        
-        p1_crop = crop_region(frame, p1_region)
-        p2_crop = crop_region(frame, p2_region)
+        p1_crop = crop_contig(frame, scaled["p1_percent"])
+        p2_crop = crop_contig(frame, scaled["p2_percent"])
         
         state["p1_percent"] = read_percent(p1_crop)
         state["p2_percent"] = read_percent(p2_crop)
         
-        # count stocks
-        state["p1_stocks"] = count_stock_icons(frame, regions, "p1", scale_x, scale_y)
-        state["p2_stocks"] = count_stock_icons(frame, regions, "p2", scale_x, scale_y)
-        
-        # Score this layout - prefer layouts that detect both percents
-        score = 0
-        if state["p1_percent"] is not None:
-            score += 2
-        if state["p2_percent"] is not None:
-            score += 2
-        if state["p1_stocks"] is not None:
-            score += 1
-        if state["p2_stocks"] is not None:
-            score += 1
-        
-        if score > best_score:
-            best_score = score
-            best_state = state
-            
-        # If we got both percents, use this layout
-        if state["p1_percent"] is not None and state["p2_percent"] is not None:
+        if state["p1_percent"] is not None or state["p2_percent"] is not None:
+            layout = (regions, base_w, base_h)
+            found = True
             break
     
+    if layout_cache is not None:
+        if locked_layout is not None:
+            _record_locked_read(layout_cache, locked_layout, found)
+        elif found:
+            _record_layout(layout_cache, layout)
+    
+    # count stocks (only for the chosen layout)
+    scaled = _get_scaled_layout(*layout, w, h)
+    state["p1_stocks"] = _count_stock_icons(frame, scaled, "p1")
+    state["p2_stocks"] = _count_stock_icons(frame, scaled, "p2")
+    
     # Detect characters (only if we have a valid state)
-    if best_state and best_score > 0:
+    if any(state[k] is not None for k in ("p1_percent", "p2_percent", "p1_stocks", "p2_stocks")):
         chars = detect_characters(frame)
-        best_state["p1_character"] = chars.get("p1_character")
-        best_state["p2_character"] = chars.get("p2_character")
-        return best_state
+        state["p1_character"] = chars.get("p1_character")
+        state["p2_character"] = chars.get("p2_character")
+        return state
     
     return None
 
 
+def prepare_game_state(frame, timestamp: float, layout: tuple) -> tuple:
+    """
+    CV half of detect_game_state for a known layout, for batching the OCR.
+    Returns (state, p1_crop, p2_crop, layout): stocks and characters are filled
+    in, percents are left for finish_game_states to read.
+    """
+    h, w = frame.shape[:2]
+    scaled = _get_scaled_layout(*layout, w, h)
+    
+    state = {
+        "timestamp": round(timestamp, 2),
+        "p1_percent": None,
+        "p2_percent": None,
+        "p1_stocks": _count_stock_icons(frame, scaled, "p1"),
+        "p2_stocks": _count_stock_icons(frame, scaled, "p2"),
+        "p1_character": None,
+        "p2_character": None,
+    }
+    chars = detect_characters(frame)
+    state["p1_character"] = chars.get("p1_character")
+    state["p2_character"] = chars.get("p2_character")
+    
+    # copies, so the pending batch doesn't keep whole frames alive
+    p1_crop = crop_view(frame, scaled["p1_percent"]).copy()
+    p2_crop = crop_view(frame, scaled["p2_percent"]).copy()
+    return state, p1_crop, p2_crop, layout
+
+
+def finish_game_states(pending: list, layout_cache: dict = None) -> list:
+    """
+    OCR half: read the percents of all prepare_game_state results in one batch.
+    Returns a state or None per entry, like detect_game_state. With the
+    layout_cache that locked the layout, frames that read no percent count
+    towards dropping the lock.
+    """
+    crops = []
+    for _, p1_crop, p2_crop, _ in pending:
+        crops += [p1_crop, p2_crop]
+    percents = read_percent_batch(crops)
+    
+    states = []
+    for i, (state, _, _, layout) in enumerate(pending):
+        state["p1_percent"] = percents[2 * i]
+        state["p2_percent"] = percents[2 * i + 1]
+        if layout_cache is not None:
+            found = state["p1_percent"] is not None or state["p2_percent"] is not None
+            _record_locked_read(layout_cache, layout, found)
+        if any(state[k] is not None for k in ("p1_percent", "p2_percent", "p1_stocks", "p2_stocks")):
+            states.append(state)
+        else:
+            states.append(None)
+    return states
+
+
+def _record_layout(layout_cache: dict, layout: tuple):
+    """Count consecutive wins of the same layout and lock it after LAYOUT_LOCK_STREAK."""
+    if layout_cache.get("last") is not None and layout_cache["last"][0] is layout[0]:
+        layout_cache["streak"] = layout_cache.get("streak", 0) + 1
+    else:
+        layout_cache["last"] = layout
+        layout_cache["streak"] = 1
+    if layout_cache["streak"] >= LAYOUT_LOCK_STREAK:
+        layout_cache["locked"] = layout
+        layout_cache["misses"] = 0
+
+
+def _record_locked_read(layout_cache: dict, layout: tuple, found: bool):
+    """Count consecutive locked frames without a percent; unlock after LAYOUT_UNLOCK_MISSES."""
+    if layout_cache.get("locked") is not layout:
+        return  # read with a lock that has since been dropped
+    if found:
+        layout_cache["misses"] = 0
+        return
+    layout_cache["misses"] = layout_cache.get("misses", 0) + 1
+    if layout_cache["misses"] >= LAYOUT_UNLOCK_MISSES:
+        # back to scanning every layout; a layout has to win a new streak to lock again
+        del layout_cache["locked"]
+        layout_cache["last"] = None
+        layout_cache["streak"] = 0
+        layout_cache["misses"] = 0
+
+
 def detect_layout(frame) -> tuple:
     """
     Detect which HUD layout is being used (tournament overlay vs standard).
@@ -225,6 +332,11 @@ def detect_layout(frame) -> tuple:
             return UI_REGIONS_1080P, 1920, 1080
 
 
+# saturation > 80 and value > 100 (inRange bounds are inclusive)
+_HUD_COLOR_LOWER = np.array([0, 81, 101], dtype=np.uint8)
+_HUD_COLOR_UPPER = np.array([180, 255, 255], dtype=np.uint8)
+
+
 def _detect_tournament_overlay(frame) -> bool:
     """
     Detect if the frame has a tournament overlay (HUD in center)
@@ -244,31 +356,33 @@ def _detect_tournament_overlay(frame) -> bool:
     left_edge = frame[bottom_start:, :int(w * 0.15)]
     right_edge = frame[bottom_start:, int(w * 0.85):]
     
+    # one HSV conversion per region feeds both scores
+    hsv_center, hsv_left, hsv_right = [
+        cv2.cvtColor(r, cv2.COLOR_BGR2HSV) if r.size else None
+        for r in (center_region, left_edge, right_edge)
+    ]
+    
     # analyze color content - HUD elements are typically colorful
-    def get_color_score(region):
-        if region.size == 0:
+    def get_color_score(hsv):
+        if hsv is None:
             return 0
-        hsv = cv2.cvtColor(region, cv2.COLOR_BGR2HSV)
-        # high saturation = colorful (HUD elements)
-        sat = hsv[:, :, 1]
-        val = hsv[:, :, 2]
-        # count pixels that are both colorful and bright
-        colorful_bright = np.sum((sat > 80) & (val > 100))
-        return colorful_bright / region.size * 100
-    
-    center_score = get_color_score(center_region)
-    edge_score = (get_color_score(left_edge) + get_color_score(right_edge)) / 2
-    
-    # also check for edge density (text/numbers)
-    def get_edge_score(region):
-        if region.size == 0:
+        # count pixels that are both colorful (high saturation = HUD elements) and bright
+        colorful_bright = cv2.countNonZero(cv2.inRange(hsv, _HUD_COLOR_LOWER, _HUD_COLOR_UPPER))
+        return colorful_bright / hsv.size * 100
+    
+    center_score = get_color_score(hsv_center)
+    edge_score = (get_color_score(hsv_left) + get_color_score(hsv_right)) / 2
+    
+    # also check for edge density (text/numbers). V (max channel) stands in for
+    # luminance so no separate gray conversion is needed
+    def get_edge_score(hsv):
+        if hsv is None:
             return 0
-        gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        return np.sum(edges > 0) / edges.size * 100
+        edges = cv2.Canny(cv2.extractChannel(hsv, 2), 50, 150)
+        return cv2.countNonZero(edges) / edges.size * 100
     
-    center_edges = get_edge_score(center_region)
-    edge_edges = (get_edge_score(left_edge) + get_edge_score(right_edge)) / 2
+    center_edges = get_edge_score(hsv_center)
+    edge_edges = (get_edge_score(hsv_left) + get_edge_score(hsv_right)) / 2
     
     # tournament overlay: more content in center
     # standard HUD: more content at edges
@@ -282,9 +396,48 @@ def get_scaled_region(region, scale_x, scale_y):
     x, y, w, h = region
     return (int(x * scale_x), int(y * scale_y), int(w * scale_x), int(h * scale_y))
 
-def crop_region(frame, region):
+def _scale_layout(regions: dict, scale_x, scale_y) -> dict:
+    """Scale every region of a layout, plus the stock icon metrics, to frame pixels."""
+    return {
+        "p1_percent": get_scaled_region(regions["p1_percent"], scale_x, scale_y),
+        "p2_percent": get_scaled_region(regions["p2_percent"], scale_x, scale_y),
+        "p1_stocks": get_scaled_region(regions["p1_stocks"], scale_x, scale_y),
+        "p2_stocks": get_scaled_region(regions["p2_stocks"], scale_x, scale_y),
+        "icon_width": int(regions.get("stock_icon_width", 25) * scale_x),
+        "icon_spacing": int(regions.get("stock_spacing", 4) * scale_x),
+        "scale_x": scale_x,
+        "scale_y": scale_y,
+    }
+
+def _get_scaled_layout(regions: dict, base_w: int, base_h: int, w: int, h: int) -> dict:
+    """_scale_layout memoized per layout and frame size."""
+    key = (id(regions), w, h)
+    scaled = _SCALED_CACHE.get(key)
+    if scaled is None:
+        scaled = _SCALED_CACHE[key] = _scale_layout(regions, w / base_w, h / base_h)
+    return scaled
+
+def crop_view(frame, region):
+    """Crop clamped to the frame, as a view. Fine for cv2 routines that take strided input."""
     x, y, w, h = region
-    return frame[y:y+h, x:x+w]
+    fh, fw = frame.shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(fw, x + w), min(fh, y + h)
+    return frame[y0:y1, x0:x1]
+
+def crop_contig(frame, region):
+    """Clamped crop in contiguous memory, for OCR (which would copy a strided view anyway)."""
+    return np.ascontiguousarray(crop_view(frame, region))
+
+# kept for callers that predate the view/contiguous split
+crop_region = crop_view
+
+# structuring element for the stock-icon morphology, shared across calls
+_KERNEL_2X2 = np.ones((2, 2), np.uint8)
+
+# moderate-to-high saturation and value: the colorful stock icon art
+_STOCK_COLOR_LOWER = np.array([0, 30, 60])
+_STOCK_COLOR_UPPER = np.array([180, 255, 255])
 
 def count_stock_icons(frame, regions: dict, player: str, scale_x, scale_y) -> int:
     """
@@ -293,34 +446,38 @@ def count_stock_icons(frame, regions: dict, player: str, scale_x, scale_y) -> in
     Stock icons in Smash Ultimate are small character head portraits arranged
     horizontally. Each player starts with 3 and loses them from right to left.
     """
-    region_key = f"{player}_stocks"
-    region = get_scaled_region(regions[region_key], scale_x, scale_y)
-    crop = crop_region(frame, region)
+    return _count_stock_icons(frame, _scale_layout(regions, scale_x, scale_y), player)
+
+def _count_stock_icons(frame, scaled: dict, player: str) -> int:
+    """count_stock_icons on a pre-scaled layout (see _get_scaled_layout)."""
+    crop = crop_view(frame, scaled[f"{player}_stocks"])
     
     if crop is None or crop.size == 0:
         return None
     
-    crop_h, crop_w = crop.shape[:2]
+    icon_width = scaled["icon_width"]
+    icon_spacing = scaled["icon_spacing"]
+    scale_x, scale_y = scaled["scale_x"], scaled["scale_y"]
     
-    # get expected icon dimensions from config
-    icon_width = int(regions.get("stock_icon_width", 25) * scale_x)
-    icon_spacing = int(regions.get("stock_spacing", 4) * scale_x)
+    # color conversions shared by the detectors below
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
     
     # try multiple detection methods and pick most reliable
     results = []
     
     # method 1: detect distinct colored regions (character heads are colorful)
-    count1 = _count_by_colored_blobs(crop, icon_width)
+    count1 = _count_by_colored_blobs(hsv, icon_width)
     if count1 is not None:
         results.append(count1)
     
     # method 2: analyze horizontal profile for distinct peaks
-    count2 = _count_by_horizontal_profile(crop, icon_width, icon_spacing)
+    count2 = _count_by_horizontal_profile(gray, icon_width, icon_spacing)
     if count2 is not None:
         results.append(count2)
     
     # method 3: detect by edge contours with shape filtering
-    count3 = _count_by_contours(crop, icon_width, scale_x, scale_y)
+    count3 = _count_by_contours(gray, icon_width, scale_x, scale_y)
     if count3 is not None:
         results.append(count3)
     
@@ -328,35 +485,24 @@ def count_stock_icons(frame, regions: dict, player: str, scale_x, scale_y) -> in
         return None
     
     # return the most common result (mode), biased toward 3 if tied
-    # (more likely to have 3 stocks than fewer at any given moment)
-    from collections import Counter
-    counts = Counter(results)
-    if counts:
-        # if there's a tie including 3, prefer 3
-        max_count = max(counts.values())
-        candidates = [k for k, v in counts.items() if v == max_count]
-        return max(candidates)  # prefer higher stock count in ties
-    
-    return None
+    # (more likely to have 3 stocks than fewer at any given moment).
+    # at most three results, so tally by hand rather than building a Counter
+    return max(set(results), key=lambda v: (results.count(v), v))
 
 
-def _count_by_colored_blobs(crop, expected_icon_width: int) -> int:
+def _count_by_colored_blobs(hsv, expected_icon_width: int) -> int:
     """
     Count stock icons by finding distinct colored blobs.
     Character head icons are typically colorful with distinct outlines.
+    Takes the HSV stock crop.
     """
-    hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
-    
     # look for pixels with moderate-to-high saturation and value
     # this captures the colorful character art but ignores dark backgrounds
-    lower = np.array([0, 30, 60])
-    upper = np.array([180, 255, 255])
-    mask = cv2.inRange(hsv, lower, upper)
+    mask = cv2.inRange(hsv, _STOCK_COLOR_LOWER, _STOCK_COLOR_UPPER)
     
     # morphological operations to clean up and separate icons
-    kernel = np.ones((2, 2), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, _KERNEL_2X2)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, _KERNEL_2X2)
     
     # find contours
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -365,44 +511,37 @@ def _count_by_colored_blobs(crop, expected_icon_width: int) -> int:
     min_area = (expected_icon_width * 0.5) ** 2
     max_area = (expected_icon_width * 2.5) ** 2
     
-    valid_contours = []
-    for c in contours:
-        area = cv2.contourArea(c)
-        if min_area < area < max_area:
-            x, y, w, h = cv2.boundingRect(c)
-            # icon should be roughly square-ish (not super wide or tall)
-            aspect = max(w, h) / (min(w, h) + 0.001)
-            if aspect < 2.5:
-                valid_contours.append((x, c))
-    
-    # sort by x position and merge nearby contours (same icon)
-    if not valid_contours:
+    if not contours:
         return 0
     
-    valid_contours.sort(key=lambda x: x[0])
+    # filter all contours at once: area, and icon should be roughly square-ish
+    # (not super wide or tall)
+    areas = np.array([cv2.contourArea(c) for c in contours])
+    rects = np.array([cv2.boundingRect(c) for c in contours], dtype=np.int32)
+    widths, heights = rects[:, 2], rects[:, 3]
+    aspect = np.maximum(widths, heights) / (np.minimum(widths, heights) + 0.001)
+    valid = (areas > min_area) & (areas < max_area) & (aspect < 2.5)
     
-    # count distinct icons by checking x-position gaps
-    icon_count = 1
-    last_x = valid_contours[0][0]
+    # sort by x position and merge nearby contours (same icon)
+    xs = np.sort(rects[valid, 0])
+    if len(xs) == 0:
+        return 0
     
-    for x, c in valid_contours[1:]:
-        # if there's a significant gap, it's a new icon
-        if x - last_x > expected_icon_width * 0.7:
-            icon_count += 1
-        last_x = x
+    # count distinct icons by x-position gaps: a significant gap starts a new icon
+    icon_count = int(np.count_nonzero(np.diff(xs) > expected_icon_width * 0.7)) + 1
     
     return min(icon_count, 3)
 
 
-def _count_by_horizontal_profile(crop, expected_icon_width: int, expected_spacing: int) -> int:
+def _count_by_horizontal_profile(gray, expected_icon_width: int, expected_spacing: int) -> int:
     """
     Count stock icons by analyzing the horizontal intensity profile.
     Icons create peaks in the profile, gaps create valleys.
+    Takes the grayscale stock crop.
     """
-    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-    
     # compute vertical sum (horizontal profile)
-    profile = np.sum(gray, axis=0).astype(float)
+    # int32 holds any column sum of a stock crop; float32 is plenty for the smoothing
+    profile = gray.sum(axis=0, dtype=np.int32).astype(np.float32)
     
     if len(profile) < 10:
         return None
@@ -411,36 +550,67 @@ def _count_by_horizontal_profile(crop, expected_icon_width: int, expected_spacin
     kernel_size = max(3, expected_icon_width // 4)
     if kernel_size % 2 == 0:
         kernel_size += 1
-    profile_smooth = cv2.GaussianBlur(profile.reshape(1, -1), (kernel_size, 1), 0).flatten()
+    # the profile is only tens of samples, too small to be worth cv2's 2D filter setup.
+    # reflect padding matches GaussianBlur's default border
+    gauss_kernel = _gaussian_kernel_1d(kernel_size)
+    padded = np.pad(profile, kernel_size // 2, mode="reflect")
+    profile_smooth = np.convolve(padded, gauss_kernel, mode="valid")
     
     # find peaks (icon locations)
     # a peak is a local maximum above threshold
     threshold = np.mean(profile_smooth) + np.std(profile_smooth) * 0.3
     
+    peaks = _find_peaks(profile_smooth, threshold, expected_icon_width * 0.5)
+    
+    return min(len(peaks), 3) if len(peaks) else 0
+
+
+@lru_cache(maxsize=None)
+def _gaussian_kernel_1d(kernel_size: int) -> np.ndarray:
+    """Flat Gaussian kernel per size; there are only a handful of icon widths. Don't mutate."""
+    return cv2.getGaussianKernel(kernel_size, 0, cv2.CV_32F).ravel()
+
+
+def _find_peaks_py(profile, threshold: float, min_spacing: float) -> np.ndarray:
+    """Local maxima above threshold, at least min_spacing apart (pure Python fallback)."""
     peaks = []
-    for i in range(1, len(profile_smooth) - 1):
-        if profile_smooth[i] > threshold:
-            if profile_smooth[i] >= profile_smooth[i-1] and profile_smooth[i] >= profile_smooth[i+1]:
+    for i in range(1, len(profile) - 1):
+        if profile[i] > threshold:
+            if profile[i] >= profile[i-1] and profile[i] >= profile[i+1]:
                 # check it's a significant peak, not noise
-                if len(peaks) == 0 or i - peaks[-1] > expected_icon_width * 0.5:
+                if len(peaks) == 0 or i - peaks[-1] > min_spacing:
                     peaks.append(i)
-    
-    return min(len(peaks), 3) if peaks else 0
+    return np.array(peaks, dtype=np.int32)
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _find_peaks_nb(profile, threshold, min_spacing):
+        peaks = np.empty(len(profile), np.int32)
+        n = 0
+        for i in range(1, len(profile) - 1):
+            if profile[i] > threshold and profile[i] >= profile[i-1] and profile[i] >= profile[i+1]:
+                if n == 0 or i - peaks[n - 1] > min_spacing:
+                    peaks[n] = i
+                    n += 1
+        return peaks[:n]
+
+    _find_peaks = _find_peaks_nb
+else:
+    _find_peaks = _find_peaks_py
 
 
-def _count_by_contours(crop, expected_icon_width: int, scale_x: float, scale_y: float) -> int:
+def _count_by_contours(gray, expected_icon_width: int, scale_x: float, scale_y: float) -> int:
     """
     Count stock icons using edge detection and contour analysis.
+    Takes the grayscale stock crop.
     """
-    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-    
     # apply edge detection
     blurred = cv2.GaussianBlur(gray, (3, 3), 0)
     edges = cv2.Canny(blurred, 30, 100)
     
     # dilate to connect edge fragments
-    kernel = np.ones((2, 2), np.uint8)
-    dilated = cv2.dilate(edges, kernel, iterations=1)
+    dilated = cv2.dilate(edges, _KERNEL_2X2, iterations=1)
     
     # find contours
     contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -449,22 +619,24 @@ def _count_by_contours(crop, expected_icon_width: int, scale_x: float, scale_y:
     min_area = (expected_icon_width * 0.3) ** 2
     max_area = (expected_icon_width * 3) ** 2
     
-    valid_xs = []
-    for c in contours:
-        area = cv2.contourArea(c)
-        if min_area < area < max_area:
-            x, y, w, h = cv2.boundingRect(c)
-            valid_xs.append(x + w // 2)  # center x
+    if not contours:
+        return 0
+    
+    areas = np.array([cv2.contourArea(c) for c in contours])
+    rects = np.array([cv2.boundingRect(c) for c in contours], dtype=np.int32)
+    valid = (areas > min_area) & (areas < max_area)
     
-    if not valid_xs:
+    # center x of each valid contour
+    valid_xs = np.sort(rects[valid, 0] + rects[valid, 2] // 2)
+    if len(valid_xs) == 0:
         return 0
     
-    # cluster x positions to count distinct icons
-    valid_xs.sort()
+    # cluster x positions to count distinct icons. gaps are measured from the
+    # first x of the current icon, not the previous contour, so this isn't a diff
     icon_count = 1
-    last_x = valid_xs[0]
+    last_x = int(valid_xs[0])
     
-    for x in valid_xs[1:]:
+    for x in valid_xs[1:].tolist():
         if x - last_x > expected_icon_width * 0.6:
             icon_count += 1
             last_x = x
@@ -1,11 +1,34 @@
 import cv2
+import numpy as np
 import os
+import queue
 import sys
+import threading
+from operator import itemgetter
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from cv.state_detector import detect_game_state, is_gameplay_frame
+from cv.smoothing_numba import smooth_all, NUMBA_AVAILABLE
+from cv.state_detector import (
+    detect_game_state, is_gameplay_frame, is_gameplay_thumbnail, prepare_game_state, finish_game_states,
+    GATE_THUMB_SIZE,
+)
+
+# sampled frames whose percent crops go through OCR together once the HUD layout is locked
+OCR_BATCH_SIZE = 32
+
+# sampling gaps (in frames) at or above this seek instead of grabbing through;
+# roughly a long keyframe interval, below it decoding forward is cheaper
+SEEK_MIN_INTERVAL = 300
+
+# items buffered between pipeline stages in process_video
+PIPELINE_QUEUE_SIZE = 8
+_PIPELINE_DONE = object()
+
+# state fields that smooth_states_vec works on, in column order
+_SMOOTHED_KEYS = ("p1_percent", "p2_percent", "p1_stocks", "p2_stocks")
+_get_readings = itemgetter(*_SMOOTHED_KEYS)
 
 def process_video(video_path: str, fps_sample: float = 0.5, progress_callback=None, max_duration: int = None):
     """
@@ -36,67 +59,188 @@ def process_video(video_path: str, fps_sample: float = 0.5, progress_callback=No
     frame_interval = int(video_fps / fps_sample) if fps_sample < video_fps else 1
     print(f"[VideoProcessor] Sampling every {frame_interval} frames ({fps_sample} fps)")
     
-    game_states = []
-    frame_num = 0
-    last_valid_p1 = 0
-    last_valid_p2 = 0
-    last_valid_p1_stocks = 3
-    last_valid_p2_stocks = 3
-    running_max_p1 = 0  # Track highest P1 percent seen
-    running_max_p2 = 0  # Track highest P2 percent seen
-    
-    while frame_num < total_frames:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # only process every nth frame
-        if frame_num % frame_interval == 0:
-            timestamp = frame_num / video_fps
-            
-            # skip non-gameplay frames (menus, loading, etc.)
-            if not is_gameplay_frame(frame):
-                frame_num += 1
-                continue
-            
-            state = detect_game_state(frame, timestamp)
-            
-            if state:
-                # Track raw max before smoothing (so we don't miss peak values)
-                raw_p1 = state.get("p1_percent")
-                raw_p2 = state.get("p2_percent")
-                if raw_p1 is not None and raw_p1 > running_max_p1 and raw_p1 <= 250:
-                    running_max_p1 = raw_p1
-                if raw_p2 is not None and raw_p2 > running_max_p2 and raw_p2 <= 250:
-                    running_max_p2 = raw_p2
+    # three-stage pipeline so decoding, the cheap CV work and OCR overlap:
+    # decoder thread -> CV thread -> OCR (this thread). OpenCV and NumPy release
+    # the GIL, and the bounded queues keep decode from running ahead of OCR
+    frame_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)  # (frame_num, frame)
+    work_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)   # ("state", state) | ("pending", prepared)
+    stop = threading.Event()
+    errors = []
+    frames_seen = [0]
+    # sticky HUD layout choice for this video. the CV thread locks it, the OCR
+    # stage (this thread) drops the lock when locked frames stop reading percents
+    layout_cache = {}
+    
+    def decode_worker():
+        try:
+            for item in _read_sampled_frames(video_path, cap, total_frames, frame_interval):
+                if not _pipeline_put(frame_queue, item, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _pipeline_put(frame_queue, _PIPELINE_DONE, stop)
+    
+    def cv_worker():
+        try:
+            while True:
+                item = _pipeline_get(frame_queue, stop)
+                if item is _PIPELINE_DONE:
+                    return
+                frame_num, frame = item
+                frames_seen[0] = frame_num + 1
+                timestamp = frame_num / video_fps
                 
-                # smooth out OCR/detection errors with sanity checks
-                state = smooth_state(
-                    state, last_valid_p1, last_valid_p2,
-                    last_valid_p1_stocks, last_valid_p2_stocks,
-                    running_max_p1, running_max_p2
-                )
+                # skip non-gameplay frames (menus, loading, etc.); None = already rejected on the GPU
+                if frame is None or not is_gameplay_frame(frame):
+                    continue
                 
-                if state["p1_percent"] is not None:
-                    last_valid_p1 = state["p1_percent"]
-                if state["p2_percent"] is not None:
-                    last_valid_p2 = state["p2_percent"]
-                if state["p1_stocks"] is not None:
-                    last_valid_p1_stocks = state["p1_stocks"]
-                if state["p2_stocks"] is not None:
-                    last_valid_p2_stocks = state["p2_stocks"]
+                locked_layout = layout_cache.get("locked")
+                if locked_layout is None:
+                    work = ("state", detect_game_state(frame, timestamp, layout_cache=layout_cache))
+                else:
+                    # layout is known: crop now, the OCR stage reads a window of frames in one batch
+                    work = ("pending", prepare_game_state(frame, timestamp, locked_layout))
+                if not _pipeline_put(work_queue, work, stop):
+                    return
                 
-                game_states.append(state)
-            
-            if progress_callback:
-                progress_callback(frame_num / total_frames)
+                if progress_callback:
+                    progress_callback(frame_num / total_frames)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _pipeline_put(work_queue, _PIPELINE_DONE, stop)
+    
+    workers = [
+        threading.Thread(target=decode_worker, name="video-decode", daemon=True),
+        threading.Thread(target=cv_worker, name="video-cv", daemon=True),
+    ]
+    for t in workers:
+        t.start()
+    
+    raw_states = []
+    pending = []  # (state, p1_crop, p2_crop) waiting for one batched OCR call
+    try:
+        while True:
+            item = _pipeline_get(work_queue, stop)
+            if item is _PIPELINE_DONE:
+                break
+            kind, payload = item
+            if kind == "pending":
+                pending.append(payload)
+                if len(pending) >= OCR_BATCH_SIZE:
+                    raw_states += finish_game_states(pending, layout_cache)
+                    pending = []
+            else:
+                if pending:
+                    raw_states += finish_game_states(pending, layout_cache)
+                    pending = []
+                raw_states.append(payload)
         
-        frame_num += 1
+        if pending:
+            raw_states += finish_game_states(pending, layout_cache)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for t in workers:
+            t.join()
+        cap.release()
     
-    cap.release()
-    print(f"[VideoProcessor] Extracted {len(game_states)} game states from {frame_num} frames")
+    if errors:
+        raise errors[0]
+    
+    # smooth out OCR/detection errors with sanity checks (each state only
+    # depends on the ones before it, so this can run after detection)
+    game_states = apply_smoothing(raw_states)
+    
+    print(f"[VideoProcessor] Extracted {len(game_states)} game states from {frames_seen[0]} frames")
     return game_states
 
+def _pipeline_put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put with backpressure; gives up (returns False) once another stage has failed."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _pipeline_get(q: queue.Queue, stop: threading.Event):
+    """Get the next item, or _PIPELINE_DONE once another stage has failed."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _PIPELINE_DONE
+
+
+def _read_sampled_frames(video_path: str, cap, total_frames: int, frame_interval: int):
+    """
+    Yield (frame_num, BGR frame) for every frame_interval-th frame.
+    Decodes on the GPU (NVDEC) when OpenCV was built with CUDA; there the
+    gameplay gate runs on a GPU-side thumbnail and frames that fail it are
+    yielded as None without ever being downloaded.
+    """
+    if _cuda_decode_available():
+        try:
+            reader = cv2.cudacodec.createVideoReader(video_path)
+        except cv2.error as e:
+            print(f"[VideoProcessor] CUDA decode unavailable, using CPU: {e}")
+        else:
+            print("[VideoProcessor] Decoding on GPU")
+            yield from _read_sampled_frames_cuda(reader, total_frames, frame_interval)
+            return
+    
+    # skipped frames are grab()bed (demuxed and decoded but never converted to
+    # BGR or copied out); past SEEK_MIN_INTERVAL a keyframe seek is cheaper
+    # than walking through them
+    for frame_num in range(0, total_frames, frame_interval):
+        if frame_num > 0:
+            if frame_interval >= SEEK_MIN_INTERVAL:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+            else:
+                for _ in range(frame_interval - 1):
+                    cap.grab()
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame_num, frame
+
+
+def _read_sampled_frames_cuda(reader, total_frames: int, frame_interval: int):
+    for frame_num in range(0, total_frames, frame_interval):
+        if frame_num > 0:
+            # skipped frames stay on the GPU
+            for _ in range(frame_interval - 1):
+                ret, _ = reader.nextFrame()
+                if not ret:
+                    return
+        ret, gpu_frame = reader.nextFrame()
+        if not ret:
+            return
+        
+        # the reader outputs BGRA; only the tiny thumbnail comes back for the gate
+        small = cv2.cuda.resize(gpu_frame, GATE_THUMB_SIZE, interpolation=cv2.INTER_NEAREST).download()
+        if not is_gameplay_thumbnail(cv2.cvtColor(small, cv2.COLOR_BGRA2BGR)):
+            yield frame_num, None
+            continue
+        # detect_game_state reads several layouts, stocks and portraits, so
+        # frames that pass are downloaded whole
+        yield frame_num, cv2.cvtColor(gpu_frame.download(), cv2.COLOR_BGRA2BGR)
+
+
+def _cuda_decode_available() -> bool:
+    try:
+        return hasattr(cv2, "cudacodec") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except cv2.error:
+        return False
+
 def smooth_state(state: dict, last_p1: int, last_p2: int, 
                   last_p1_stocks: int = None, last_p2_stocks: int = None,
                   running_max_p1: int = 0, running_max_p2: int = 0) -> dict:
@@ -166,6 +310,90 @@ def smooth_state(state: dict, last_p1: int, last_p2: int,
     
     return state
 
+def apply_smoothing(states: list) -> list:
+    """
+    Smooth a chronological list of states in place (see smooth_state) and
+    return it, dropping empty entries. The readings go through
+    smooth_states_vec as one array and only the results are written back.
+    """
+    states = [state for state in states if state]
+    if not states:
+        return []
+    
+    # one C-level itemgetter call per state rather than a .get per field
+    readings = np.array(list(map(_get_readings, states)), dtype=np.float64)
+    smoothed = smooth_states_vec(readings)
+    for state, (p1, p2, s1, s2) in zip(states, smoothed.tolist()):
+        state["p1_percent"] = None if p1 != p1 else p1
+        state["p2_percent"] = None if p2 != p2 else p2
+        state["p1_stocks"] = None if s1 != s1 else int(s1)
+        state["p2_stocks"] = None if s2 != s2 else int(s2)
+    return states
+
+def running_max_percents(percents: np.ndarray) -> np.ndarray:
+    """
+    Running max of raw percent reads per column, as smooth_state expects it:
+    tracked before smoothing (so peaks aren't missed), starting from 0, and
+    ignoring missing (NaN) and over-cap reads.
+    """
+    in_range = np.where(percents <= 250, percents, 0)  # NaN compares False
+    return np.maximum.accumulate(in_range, axis=0)
+
+def smooth_states_vec(readings: np.ndarray) -> np.ndarray:
+    """
+    smooth_state over a whole video at once.
+    readings: (N, 4) float64 array of p1/p2 percent and p1/p2 stocks per state,
+    NaN for a missing reading. Returns a smoothed copy, same layout.
+    
+    The cap and the running max only depend on the raw readings and are done
+    as array ops; the jump/drop rules compare against the last accepted value,
+    so that part is a single sequential pass (compiled with Numba if available).
+    """
+    MAX_PERCENT = 250
+    
+    out = readings.copy()
+    percents = out[:, :2]
+    running_max = running_max_percents(percents)
+    percents[percents > MAX_PERCENT] = np.nan
+    
+    return _smooth_rows(out, running_max)
+
+def _smooth_rows_py(readings: np.ndarray, running_max: np.ndarray) -> np.ndarray:
+    """Sequential half of smooth_states_vec over plain floats (see smoothing_numba.smooth_all)."""
+    max_jump = 70
+    
+    rows = readings.tolist()
+    running_max = running_max.tolist()
+    last = [0, 0, 3, 3]
+    for row, rmax in zip(rows, running_max):
+        for i in (0, 1):
+            p = row[i]
+            if p != p:
+                continue
+            if last[i] == 0 and p > 100:
+                # first read: allow up to 100% (could have missed earlier readings)
+                row[i] = np.nan
+            elif last[i] > 0 and not p > rmax[i]:
+                if p > last[i] + max_jump:
+                    row[i] = np.nan
+                elif p < last[i] - 15 and p > 10:
+                    # percent dropped but not to near-zero: OCR error
+                    row[i] = np.nan
+            if row[i] == row[i]:
+                last[i] = row[i]
+        for i in (2, 3):
+            s = row[i]
+            if s != s:
+                continue
+            # stocks can only decrease by 1 at a time and never increase
+            if s < last[i] - 1 or s > last[i]:
+                row[i] = last[i]
+            last[i] = row[i]
+    
+    return np.array(rows, dtype=readings.dtype).reshape(readings.shape)
+
+_smooth_rows = smooth_all if NUMBA_AVAILABLE else _smooth_rows_py
+
 def extract_frames(video_path: str, output_dir: str, fps_sample: int = 2):
     """Save frames to disk for debugging/training data collection."""
     Path(output_dir).mkdir(parents=True, exist_ok=True)
@@ -1,20 +1,55 @@
 """
-Parallel video processor using chunked processing with overlap.
-Significantly faster than sequential processing while maintaining accuracy.
+Parallel video processor using chunked processing.
+Chunks run in worker processes; significantly faster than sequential processing while maintaining accuracy.
+
+Each worker decodes its own chunk, which costs a seek per chunk. The
+single-decoder alternative (one sequential decode feeding the detection
+stages through bounded queues) is cv.video_processor.process_video.
 """
 import cv2
+import heapq
+import multiprocessing
 import os
 import sys
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 from typing import List, Callable, Optional
 import threading
 
+# Optional psutil for the physical core count
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from cv.state_detector import detect_game_state, is_gameplay_frame
-from cv.video_processor import smooth_state  # reuse existing smoothing logic
+from cv.state_detector import (
+    detect_game_state, is_gameplay_frame, is_gameplay_thumbnail, prepare_game_state, finish_game_states,
+    GATE_THUMB_SIZE,
+)
+from cv.video_processor import apply_smoothing as _apply_smoothing  # reuse existing smoothing logic
+from cv.video_processor import _cuda_decode_available, OCR_BATCH_SIZE
+from cv.video_processor import process_video as _process_video_sequential
+from cv.ocr import init_reader
+
+# per-process CUDA buffer pool for the NVDEC chunk reader: bytes per stack, and
+# stacks (one per stream a worker may use concurrently)
+CUDA_BUFFER_POOL_SIZE = 64 * 1024 * 1024
+CUDA_BUFFER_POOL_STACKS = 1
+
+# per worker (thread or process) capture reused across chunks, see _get_worker_cap
+_worker_caps = threading.local()
+
+# each worker process loads its own EasyOCR/torch model; this is budgeted per
+# worker against available memory, and PARALLEL_MAX_WORKERS caps the count
+WORKER_MEMORY_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 8
+
+# native thread pools (torch, MKL) a worker pins to one thread; read when they first load
+_WORKER_THREAD_ENV = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
 
 
 @dataclass
@@ -34,8 +69,6 @@ class ChunkSpec:
     end_frame: int
     start_time: float
     end_time: float
-    is_first: bool
-    is_last: bool
 
 
 def process_video_parallel(
@@ -45,7 +78,7 @@ def process_video_parallel(
     max_duration: int = None,
     num_workers: int = None,
     chunk_duration: float = 45.0,  # seconds per chunk
-    overlap_duration: float = 5.0,  # seconds of overlap between chunks
+    overlap_duration: float = 0.0,  # seconds of overlap between chunks
 ) -> List[dict]:
     """
     Extract frames from video using parallel chunk processing.
@@ -55,12 +88,19 @@ def process_video_parallel(
         fps_sample: Frames per second to sample
         progress_callback: Function to call with progress (0-1)
         max_duration: Maximum seconds of video to process
-        num_workers: Number of parallel workers (default: CPU count)
+        num_workers: Number of parallel workers (default: physical cores available,
+            bounded by memory and PARALLEL_MAX_WORKERS)
         chunk_duration: Duration of each chunk in seconds
-        overlap_duration: Overlap between chunks in seconds
+        overlap_duration: Overlap between chunks in seconds. Detection is per
+            frame, so chunks don't need context from their neighbours
     
     Returns:
         List of game states, smoothed and in chronological order
+    
+    Chunks run in worker processes started with forkserver/spawn, which
+    re-import the caller's main module: scripts calling this must do so under
+    an ``if __name__ == "__main__":`` guard. Chunks whose worker fails are
+    re-run in this process, so a failure never leaves a hole in the timeline.
     """
     # Get video properties
     cap = cv2.VideoCapture(video_path)
@@ -85,8 +125,13 @@ def process_video_parallel(
     
     # Determine number of workers
     if num_workers is None:
-        import multiprocessing
-        num_workers = min(multiprocessing.cpu_count(), 8)
+        num_workers = _default_num_workers()
+    
+    # a single chunk (or worker) gains nothing from the pool, and starting worker
+    # processes that each import cv2 and load the OCR model costs more than a short clip
+    if duration <= chunk_duration or num_workers == 1:
+        print("[ParallelProcessor] Single chunk, processing sequentially")
+        return _process_video_sequential(video_path, fps_sample, progress_callback, max_duration)
     
     # Create chunk specifications
     chunks = _create_chunks(
@@ -98,25 +143,27 @@ def process_video_parallel(
     
     print(f"[ParallelProcessor] Processing {len(chunks)} chunks with {num_workers} workers")
     
-    # Progress tracking
-    progress_lock = threading.Lock()
-    chunks_completed = [0]
+    # Progress tracking (completions are only handled on this thread, see below)
+    chunks_completed = 0
     total_chunks = len(chunks)
     
-    def update_progress():
-        with progress_lock:
-            chunks_completed[0] += 1
-            if progress_callback:
-                # Reserve last 10% for smoothing pass
-                progress_callback(0.9 * chunks_completed[0] / total_chunks)
-    
     # Process chunks in parallel
     chunk_results: List[ChunkResult] = [None] * len(chunks)
     
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # NVDEC decode when OpenCV was built with cudacodec and a GPU is present
+    process_chunk = _process_chunk_cuda if _cuda_decode_available() else _process_chunk
+    
+    # Chunks run in separate processes: detection is largely Python code that
+    # holds the GIL, so threads would mostly take turns. Each worker opens its
+    # own VideoCapture; states are merged by timestamp and smoothed below
+    with ProcessPoolExecutor(
+        max_workers=min(num_workers, len(chunks)),
+        mp_context=_worker_context(),
+        initializer=_init_worker,
+    ) as executor:
         futures = {
             executor.submit(
-                _process_chunk,
+                process_chunk,
                 video_path,
                 chunk,
                 frame_interval,
@@ -130,21 +177,30 @@ def process_video_parallel(
             try:
                 result = future.result()
                 chunk_results[chunk_idx] = result
-                update_progress()
+                chunks_completed += 1
+                if progress_callback:
+                    # Reserve last 10% for smoothing pass
+                    progress_callback(0.9 * chunks_completed / total_chunks)
                 print(f"[ParallelProcessor] Chunk {chunk_idx + 1}/{len(chunks)} done: {len(result.states)} states")
             except Exception as e:
-                print(f"[ParallelProcessor] Chunk {chunk_idx} failed: {e}")
-                # Store empty result to maintain order
-                chunk_results[chunk_idx] = ChunkResult(
-                    chunk_idx=chunk_idx,
-                    start_time=chunks[chunk_idx].start_time,
-                    end_time=chunks[chunk_idx].end_time,
-                    states=[]
-                )
-    
-    # Merge chunks, handling overlaps
+                print(f"[ParallelProcessor] Chunk {chunk_idx} failed in worker: {e}")
+    
+    # A worker can die (pickling error, missing __main__ guard, OOM kill) where
+    # the same chunk would run fine here. Re-run it on this process rather than
+    # leave a chunk_duration hole that reads as missing percents and stocks;
+    # if it fails here too, the error propagates and the caller falls back
+    for chunk in chunks:
+        if chunk_results[chunk.chunk_idx] is not None:
+            continue
+        print(f"[ParallelProcessor] Re-running chunk {chunk.chunk_idx + 1}/{len(chunks)} sequentially")
+        chunk_results[chunk.chunk_idx] = process_chunk(video_path, chunk, frame_interval, video_fps)
+        chunks_completed += 1
+        if progress_callback:
+            progress_callback(0.9 * chunks_completed / total_chunks)
+    
+    # Merge chunks
     print("[ParallelProcessor] Merging chunks...")
-    merged_states = _merge_chunks(chunk_results, chunks, overlap_duration)
+    merged_states = _merge_chunks(chunk_results)
     print(f"[ParallelProcessor] Merged into {len(merged_states)} states")
     
     # Apply sequential smoothing pass
@@ -158,13 +214,74 @@ def process_video_parallel(
     return smoothed_states
 
 
+def _default_num_workers() -> int:
+    """
+    One worker per physical core we may run on. Decode and OCR don't gain from
+    SMT siblings, so logical cores would just oversubscribe. Every worker holds
+    its own OCR model, so the count is also bounded by available memory and by
+    PARALLEL_MAX_WORKERS (default DEFAULT_MAX_WORKERS).
+    """
+    # cores this process may use (cgroup/affinity limits), where the OS exposes it
+    if hasattr(os, "sched_getaffinity"):
+        available = len(os.sched_getaffinity(0))
+    else:
+        available = multiprocessing.cpu_count()
+    
+    physical = psutil.cpu_count(logical=False) if PSUTIL_AVAILABLE else None
+    if physical:
+        workers = min(physical, available)
+    else:
+        # without psutil, assume two hardware threads per core
+        workers = available // 2
+    
+    if PSUTIL_AVAILABLE:
+        workers = min(workers, psutil.virtual_memory().available // WORKER_MEMORY_BYTES)
+    try:
+        ceiling = int(os.getenv("PARALLEL_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+    except ValueError:
+        ceiling = DEFAULT_MAX_WORKERS
+    return max(1, min(workers, ceiling))
+
+
+def _init_worker():
+    """
+    Pool initializer, once per worker process. Each worker gets one core's
+    worth of chunks, so torch, OpenMP/MKL and OpenCV are pinned to a single
+    thread; their default pools are as wide as the machine and N workers would
+    oversubscribe it N times over. Then the OCR model is loaded up front, since
+    forkserver/spawn children don't inherit the parent's reader.
+    """
+    for var in _WORKER_THREAD_ENV:
+        os.environ[var] = "1"
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(1)
+        torch.set_num_interop_threads(1)
+    except ImportError:
+        pass
+    init_reader()
+
+
+def _worker_context():
+    """
+    Start method for chunk workers. Not plain fork: the caller may already run
+    threads (the API server, torch's pools) whose locks a forked child inherits
+    mid-use. forkserver forks from a clean, single-threaded server; spawn where
+    that isn't available (macOS, Windows).
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
 def _create_chunks(
     total_frames: int,
     video_fps: float,
     chunk_duration: float,
     overlap_duration: float
 ) -> List[ChunkSpec]:
-    """Create chunk specifications with overlap."""
+    """Create chunk specifications (back to back unless overlap_duration > 0)."""
     chunks = []
     duration = total_frames / video_fps
     
@@ -182,9 +299,7 @@ def _create_chunks(
             start_frame=int(start_time * video_fps),
             end_frame=int(end_time * video_fps),
             start_time=start_time,
-            end_time=end_time,
-            is_first=(chunk_idx == 0),
-            is_last=(end_time >= duration)
+            end_time=end_time
         ))
         
         start_time += step_duration
@@ -204,44 +319,41 @@ def _process_chunk(
     video_fps: float
 ) -> ChunkResult:
     """Process a single chunk of the video."""
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise ValueError(f"Could not open video: {video_path}")
+    cap = _get_worker_cap(video_path)
     
     # Seek to start of chunk
     cap.set(cv2.CAP_PROP_POS_FRAMES, chunk.start_frame)
     
     states = []
     frame_num = chunk.start_frame
+    layout_cache = {}  # sticky HUD layout choice for this chunk
+    pending = []  # prepared frames waiting for batched OCR
+    
+    to_next_sample = 0  # frames left until the next sampled one
     
     while frame_num < chunk.end_frame:
-        ret, frame = cap.read()
-        if not ret:
+        # grab() only demuxes and decodes; the color conversion and copy in
+        # retrieve() are skipped for frames between samples
+        if not cap.grab():
             break
         
         # Only process every nth frame
-        if (frame_num - chunk.start_frame) % frame_interval == 0:
+        if to_next_sample == 0:
+            to_next_sample = frame_interval - 1
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
             timestamp = frame_num / video_fps
             
             # Skip non-gameplay frames
-            if not is_gameplay_frame(frame):
-                frame_num += 1
-                continue
-            
-            state = detect_game_state(frame, timestamp)
-            if state:
-                # Mark which chunk this came from (for merge logic)
-                state["_chunk_idx"] = chunk.chunk_idx
-                state["_in_overlap"] = (
-                    (not chunk.is_first and timestamp < chunk.start_time + 5.0) or
-                    (not chunk.is_last and timestamp > chunk.end_time - 5.0)
-                )
-                states.append(state)
+            if is_gameplay_frame(frame):
+                _detect_chunk_frame(frame, timestamp, layout_cache, states, pending)
+        else:
+            to_next_sample -= 1
         
         frame_num += 1
     
-    cap.release()
-    
+    _flush_pending(states, pending, layout_cache)
     return ChunkResult(
         chunk_idx=chunk.chunk_idx,
         start_time=chunk.start_time,
@@ -250,118 +362,147 @@ def _process_chunk(
     )
 
 
-def _merge_chunks(
-    results: List[ChunkResult],
-    chunks: List[ChunkSpec],
-    overlap_duration: float
-) -> List[dict]:
-    """
-    Merge chunk results, intelligently handling overlaps.
-    
-    Strategy for overlaps:
-    - For frames in overlap regions, we have data from two chunks
-    - Prefer the frame from the chunk where it's NOT at the boundary
-    - This gives us better context (the OCR had more surrounding frames)
-    - If both have data, prefer the one with higher confidence (more non-null values)
-    """
-    # Collect all states with their timestamps
-    all_states = []
-    for result in results:
-        if result and result.states:
-            all_states.extend(result.states)
+def _process_chunk_cuda(
+    video_path: str,
+    chunk: ChunkSpec,
+    frame_interval: int,
+    video_fps: float
+) -> ChunkResult:
+    """_process_chunk with the decode on the GPU (NVDEC) through cv2.cudacodec."""
+    _init_cuda_buffer_pool()
+    
+    if hasattr(cv2.cudacodec, "VideoReaderInitParams"):
+        params = cv2.cudacodec.VideoReaderInitParams()
+        params.firstFrameIdx = chunk.start_frame
+        reader = cv2.cudacodec.createVideoReader(video_path, params=params)
+    else:
+        # older builds can't start mid-stream; decode up to the chunk on the GPU
+        reader = cv2.cudacodec.createVideoReader(video_path)
+        for _ in range(chunk.start_frame):
+            if not reader.grab():
+                break
     
-    # Sort by timestamp
-    all_states.sort(key=lambda s: s["timestamp"])
+    states = []
+    frame_num = chunk.start_frame
+    layout_cache = {}  # sticky HUD layout choice for this chunk
+    pending = []  # prepared frames waiting for batched OCR
+    host_frame = None  # download buffer, reused across samples
     
-    # Deduplicate overlapping timestamps
-    # For each timestamp, pick the best state
-    merged = []
-    i = 0
+    to_next_sample = 0  # frames left until the next sampled one
     
-    while i < len(all_states):
-        current = all_states[i]
-        timestamp = current["timestamp"]
-        
-        # Collect all states at this timestamp (from different chunks)
-        same_time_states = [current]
-        j = i + 1
-        while j < len(all_states) and abs(all_states[j]["timestamp"] - timestamp) < 0.1:
-            same_time_states.append(all_states[j])
-            j += 1
-        
-        # Pick the best state
-        if len(same_time_states) == 1:
-            best = same_time_states[0]
-        else:
-            # Score each state by data quality
-            def score_state(s):
-                score = 0
-                if s.get("p1_percent") is not None:
-                    score += 2
-                if s.get("p2_percent") is not None:
-                    score += 2
-                if s.get("p1_stocks") is not None:
-                    score += 1
-                if s.get("p2_stocks") is not None:
-                    score += 1
-                # Prefer non-overlap regions
-                if not s.get("_in_overlap", False):
-                    score += 3
-                return score
+    while frame_num < chunk.end_frame:
+        if to_next_sample == 0:
+            to_next_sample = frame_interval - 1
+            ret, gpu_frame = reader.nextFrame()
+            if not ret:
+                break
+            timestamp = frame_num / video_fps
             
-            best = max(same_time_states, key=score_state)
-        
-        # Clean up internal markers
-        best_clean = {k: v for k, v in best.items() if not k.startswith("_")}
-        merged.append(best_clean)
+            # the reader outputs BGRA; only the tiny thumbnail comes back for the gate
+            small = cv2.cuda.resize(gpu_frame, GATE_THUMB_SIZE, interpolation=cv2.INTER_NEAREST).download()
+            if is_gameplay_thumbnail(cv2.cvtColor(small, cv2.COLOR_BGRA2BGR)):
+                host_frame = gpu_frame.download(host_frame)
+                frame = cv2.cvtColor(host_frame, cv2.COLOR_BGRA2BGR)
+                _detect_chunk_frame(frame, timestamp, layout_cache, states, pending)
+        else:
+            # skipped frames are decoded but never leave the GPU
+            to_next_sample -= 1
+            if not reader.grab():
+                break
         
-        i = j
+        frame_num += 1
     
-    return merged
+    _flush_pending(states, pending, layout_cache)
+    return ChunkResult(
+        chunk_idx=chunk.chunk_idx,
+        start_time=chunk.start_time,
+        end_time=chunk.end_time,
+        states=states
+    )
 
 
-def _apply_smoothing(states: List[dict]) -> List[dict]:
-    """Apply sequential smoothing pass to merged states."""
-    if not states:
-        return []
-    
-    smoothed = []
-    last_valid_p1 = 0
-    last_valid_p2 = 0
-    last_valid_p1_stocks = 3
-    last_valid_p2_stocks = 3
-    running_max_p1 = 0
-    running_max_p2 = 0
-    
-    for state in states:
-        # Track raw max before smoothing
-        raw_p1 = state.get("p1_percent")
-        raw_p2 = state.get("p2_percent")
-        if raw_p1 is not None and raw_p1 > running_max_p1 and raw_p1 <= 250:
-            running_max_p1 = raw_p1
-        if raw_p2 is not None and raw_p2 > running_max_p2 and raw_p2 <= 250:
-            running_max_p2 = raw_p2
-        
-        # Apply smoothing
-        state = smooth_state(
-            state, last_valid_p1, last_valid_p2,
-            last_valid_p1_stocks, last_valid_p2_stocks,
-            running_max_p1, running_max_p2
-        )
-        
-        # Update tracking values
-        if state["p1_percent"] is not None:
-            last_valid_p1 = state["p1_percent"]
-        if state["p2_percent"] is not None:
-            last_valid_p2 = state["p2_percent"]
-        if state["p1_stocks"] is not None:
-            last_valid_p1_stocks = state["p1_stocks"]
-        if state["p2_stocks"] is not None:
-            last_valid_p2_stocks = state["p2_stocks"]
-        
-        smoothed.append(state)
-    
-    return smoothed
+def _detect_chunk_frame(frame, timestamp: float, layout_cache: dict, states: list, pending: list):
+    """
+    detect_game_state for one sampled frame of a chunk, appending to states.
+    Once the HUD layout is locked the OCR is deferred like in process_video:
+    prepare_game_state keeps just the percent crops, and they're read
+    OCR_BATCH_SIZE frames at a time, so no decoded frames are held.
+    """
+    locked = layout_cache.get("locked")
+    if locked is None:
+        _flush_pending(states, pending, layout_cache)  # keep states in frame order
+        state = detect_game_state(frame, timestamp, layout_cache=layout_cache)
+        if state:
+            states.append(state)
+        return
+    
+    pending.append(prepare_game_state(frame, timestamp, locked))
+    if len(pending) >= OCR_BATCH_SIZE:
+        _flush_pending(states, pending, layout_cache)
+
+
+def _flush_pending(states: list, pending: list, layout_cache: dict):
+    """
+    Read the percents of the pending frames in one batch and append their states.
+    Frames that read no percent count towards dropping layout_cache's lock.
+    """
+    if pending:
+        states.extend(state for state in finish_game_states(pending, layout_cache) if state)
+        pending.clear()
+
+
+def _get_worker_cap(video_path: str) -> cv2.VideoCapture:
+    """
+    This worker's VideoCapture for video_path. A worker usually gets several
+    chunks of the same video, so the capture stays open between them instead of
+    re-opening (and re-probing) the container per chunk. Replaced when the path
+    or file changes; the last one goes away with the worker.
+    """
+    # mtime in the key so a file replaced at the same path gets a fresh capture
+    key = (video_path, os.path.getmtime(video_path))
+    if getattr(_worker_caps, "key", None) != key:
+        if getattr(_worker_caps, "cap", None) is not None:
+            _worker_caps.cap.release()
+            _worker_caps.cap = None
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video: {video_path}")
+        _worker_caps.cap, _worker_caps.key = cap, key
+    return _worker_caps.cap
+
+
+_cuda_pool_ready = False
+
+def _init_cuda_buffer_pool():
+    """
+    Once per worker process, before its first GPU allocation: let OpenCV's CUDA
+    routines take scratch buffers from a preallocated pool instead of a
+    cudaMalloc per small per-frame allocation.
+    """
+    global _cuda_pool_ready
+    if _cuda_pool_ready:
+        return
+    cv2.cuda.setBufferPoolUsage(True)
+    cv2.cuda.setBufferPoolConfig(cv2.cuda.getDevice(), CUDA_BUFFER_POOL_SIZE, CUDA_BUFFER_POOL_STACKS)
+    _cuda_pool_ready = True
+
+
+def _merge_chunks(results: List[ChunkResult]) -> List[dict]:
+    """
+    Merge chunk results into one chronological list. Each chunk's states are
+    already in timestamp order, so this is a k-way merge. Chunks don't overlap
+    by default; with an overlap, a frame both chunks sampled is kept once.
+    """
+    merged = []
+    for state in heapq.merge(
+        *[r.states for r in results if r and r.states], key=lambda s: s["timestamp"]
+    ):
+        # same frame, same (rounded) timestamp. not a time window: at high
+        # sample rates neighbouring samples are ~0.1s apart
+        if merged and state["timestamp"] == merged[-1]["timestamp"]:
+            continue
+        merged.append(state)
+    return merged
 
 
 # Convenience function to replace the original
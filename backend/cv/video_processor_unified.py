@@ -114,52 +114,6 @@ def process_video(
     return states
 
 
-def _apply_smoothing(states: List[dict]) -> List[dict]:
-    """Apply smoothing pass to cloud-extracted states."""
-    from cv.video_processor import smooth_state
-    
-    if not states:
-        return []
-    
-    smoothed = []
-    last_valid_p1 = 0
-    last_valid_p2 = 0
-    last_valid_p1_stocks = 3
-    last_valid_p2_stocks = 3
-    running_max_p1 = 0
-    running_max_p2 = 0
-    
-    for state in states:
-        # Track raw max before smoothing
-        raw_p1 = state.get("p1_percent")
-        raw_p2 = state.get("p2_percent")
-        if raw_p1 is not None and raw_p1 > running_max_p1 and raw_p1 <= 250:
-            running_max_p1 = raw_p1
-        if raw_p2 is not None and raw_p2 > running_max_p2 and raw_p2 <= 250:
-            running_max_p2 = raw_p2
-        
-        # Apply smoothing
-        state = smooth_state(
-            state, last_valid_p1, last_valid_p2,
-            last_valid_p1_stocks, last_valid_p2_stocks,
-            running_max_p1, running_max_p2
-        )
-        
-        # Update tracking values
-        if state["p1_percent"] is not None:
-            last_valid_p1 = state["p1_percent"]
-        if state["p2_percent"] is not None:
-            last_valid_p2 = state["p2_percent"]
-        if state["p1_stocks"] is not None:
-            last_valid_p1_stocks = state["p1_stocks"]
-        if state["p2_stocks"] is not None:
-            last_valid_p2_stocks = state["p2_stocks"]
-        
-        smoothed.append(state)
-    
-    return smoothed
-
-
 # Configuration helpers
 def get_processing_mode() -> str:
     """Get the current processing mode that will be used."""
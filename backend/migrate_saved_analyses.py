@@ -6,8 +6,16 @@ This allows instant loading instead of re-processing the video every time.
 import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+# Optional orjson (much faster on the long game_states lists)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # Add backend to path
 sys.path.insert(0, str(Path(__file__).parent))
 
@@ -15,20 +23,33 @@ from cv.video_processor import process_video
 
 SAVED_ANALYSES_DIR = Path(__file__).parent.parent / "data" / "saved_analyses"
 
+# analyses migrated at once; process_video already keeps several cores busy
+# per video, so more than a couple just oversubscribes the CPU
+MIGRATION_WORKERS = 2
+
+def _video_fingerprint(video_path: str) -> list:
+    """(size, mtime) of the video, to tell whether saved game_states are stale."""
+    return [os.path.getsize(video_path), int(os.path.getmtime(video_path))]
+
 def migrate_analysis(json_path: Path):
     """Add game_states to a saved analysis if missing."""
     print(f"\n[Migrating] {json_path.name}")
     
-    with open(json_path) as f:
-        data = json.load(f)
+    with open(json_path, "rb") as f:
+        data = orjson.loads(f.read()) if ORJSON_AVAILABLE else json.load(f)
+    
+    video_path = data.get("video_path")
+    video_exists = bool(video_path) and os.path.exists(video_path)
     
-    # Check if already has game_states
+    # Check if already has game_states (and, if recorded, that the video hasn't changed since)
     if data.get("game_states"):
-        print(f"  Already has {len(data['game_states'])} game_states, skipping")
-        return
+        fingerprint = data.get("_video_fingerprint")
+        if not video_exists or fingerprint is None or fingerprint == _video_fingerprint(video_path):
+            print(f"  Already has {len(data['game_states'])} game_states, skipping")
+            return
+        print("  Video changed since game_states were saved, re-processing")
     
-    video_path = data.get("video_path")
-    if not video_path or not os.path.exists(video_path):
+    if not video_exists:
         print(f"  Video not found: {video_path}, skipping")
         return
     
@@ -37,23 +58,31 @@ def migrate_analysis(json_path: Path):
     print(f"  Extracted {len(game_states)} game states")
     
     data["game_states"] = game_states
+    data["_video_fingerprint"] = _video_fingerprint(video_path)
     
-    with open(json_path, "w") as f:
-        json.dump(data, f)
+    # write to a temp file and swap it in, so a crash mid-write can't truncate the analysis
+    tmp_path = json_path.with_name(json_path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(data) if ORJSON_AVAILABLE else json.dumps(data).encode())
+    os.replace(tmp_path, json_path)
     
     print(f"  Saved!")
 
+def _migrate_or_report(json_path: Path):
+    """migrate_analysis for the worker pool: one bad analysis shouldn't stop the others."""
+    try:
+        migrate_analysis(json_path)
+    except Exception as e:
+        print(f"  ERROR ({json_path.name}): {e}")
+
 def main():
     print("=== Migrating saved analyses to include game_states ===")
     
     json_files = list(SAVED_ANALYSES_DIR.glob("*.json"))
     print(f"Found {len(json_files)} saved analyses")
     
-    for json_path in json_files:
-        try:
-            migrate_analysis(json_path)
-        except Exception as e:
-            print(f"  ERROR: {e}")
+    with ProcessPoolExecutor(max_workers=MIGRATION_WORKERS) as executor:
+        list(executor.map(_migrate_or_report, json_files))
     
     print("\n=== Migration complete ===")
 